@@ -12,27 +12,73 @@
 #**************************************************************************************
 
 # 1 - Import the needed libraries 
-import cv2
-import mediapipe as mp
-import numpy as np 
-import time
-import statistics as st
+import argparse
 import os
+import subprocess
+import sys
+import cv2
 
-from collections import deque
+from dm_metrics import METRICS, serve, dump_periodically
+from dm_calibration import DEFAULT_PROFILE_DIR, ProfileStore, profile_key
+from dm_engine import DetectorEngine
+from dm_overlay import draw_overlay
+from dm_window import DROWSINESS_MODES, MIN_EAR
+from dm_roi import ROI_SIZE
+from dm_framebus import FrameBus, BUS_NAME
+from dm_events import AlertTracker, EventPublisher, console, sink_from_spec
+from dm_pipeline import Pipeline, DROP_OLDEST, OVERFLOW_POLICIES, open_capture
+
+parser = argparse.ArgumentParser(description="Driver Monitoring Systems using AI")
+parser.add_argument("--source", default="0", help="capture device index or video file (default: 0)")
+parser.add_argument("--queue-size", type=int, default=2, help="frames buffered between two stages (default: 2)")
+parser.add_argument("--overflow", choices=OVERFLOW_POLICIES, default=DROP_OLDEST,
+                    help="what a full queue does with a new frame (default: %(default)s)")
+parser.add_argument("--drowsiness-mode", choices=DROWSINESS_MODES, default=MIN_EAR,
+                    help="drowsiness rule (default: %(default)s)")
+parser.add_argument("--occupants", type=int, default=1, metavar="N",
+                    help="track up to N faces, each with its own state (default: 1, the driver only)")
+parser.add_argument("--roi", action="store_true", help="run FaceMesh on a crop around the previous face")
+parser.add_argument("--roi-size", type=int, default=ROI_SIZE, help="[px] longer side of the crop (default: %(default)s)")
+parser.add_argument("--latency-budget", type=float, default=None,
+                    help="[ms] per-frame inference budget, the crop resolution adapts to it")
+parser.add_argument("--skip", type=int, default=1, metavar="K",
+                    help="run FaceMesh on one frame out of K, predict the landmarks in between (default: 1)")
+parser.add_argument("--target-fps", type=float, default=None, help="adapt the frame skipping to hold this frame rate")
+parser.add_argument("--camera", default=None, help="camera name of the calibration profile (default: the source)")
+parser.add_argument("--vehicle", default=None, help="vehicle name of the calibration profile")
+parser.add_argument("--driver", default=None, help="driver name of the calibration profile")
+parser.add_argument("--profile-dir", default=DEFAULT_PROFILE_DIR, help="calibration profiles directory (default: %(default)s)")
+parser.add_argument("--no-profile", action="store_true", help="calibrate from scratch and don't save a profile")
+parser.add_argument("--bus", nargs="?", const=BUS_NAME, default=None, metavar="NAME",
+                    help="publish frames and overlays to a shared-memory frame bus instead of drawing them here")
+parser.add_argument("--viewer", action="store_true", help="with --bus, start a viewer process")
+parser.add_argument("--record", default=None, help="with --bus, start a recorder process encoding this video file")
+parser.add_argument("--events", nargs="+", default=None, metavar="SINK",
+                    help="publish alert start/stop events to stdout, file:PATH and/or unix:PATH")
+parser.add_argument("--metrics-port", type=int, default=None,
+                    help="serve per-stage latency histograms on http://127.0.0.1:PORT/metrics")
+parser.add_argument("--metrics-json", default=None, help="dump per-stage latency histograms to this JSON file")
+parser.add_argument("--metrics-interval", type=float, default=10.0, help="[s] between two JSON dumps (default: 10)")
+args = parser.parse_args()
+
+# Per-stage latency instrumentation (no cost when disabled)
+if args.metrics_port is not None or args.metrics_json:
+    METRICS.enable()
+if args.metrics_port is not None:
+    serve(args.metrics_port)
+if args.metrics_json:
+    dump_periodically(args.metrics_json, args.metrics_interval)
 
 # 2 - Set the desired setting
-mp_face_mesh = mp.solutions.face_mesh
-face_mesh = mp_face_mesh.FaceMesh(
-    max_num_faces=1,
-    refine_landmarks=True, # Enables  detailed eyes points
-    min_detection_confidence=0.5,
-    min_tracking_confidence=0.5
-)
-mp_drawing_styles = mp.solutions.drawing_styles
-mp_drawing = mp.solutions.drawing_utils
-
-drawing_spec = mp_drawing.DrawingSpec(thickness=1, circle_radius=1)
+##     FaceMesh and the drowsiness/distraction state are built and warmed up while the camera opens;
+##     the driver's pitch/yaw calibration comes from the camera/vehicle/driver profile when there is one
+profile = None if args.no_profile else profile_key(args.camera or args.source, args.vehicle, args.driver)
+engine = DetectorEngine(drowsiness_mode=args.drowsiness_mode, occupants=args.occupants,
+                        roi=args.roi, roi_size=args.roi_size,
+                        latency_budget=None if args.latency_budget is None else args.latency_budget / 1000,
+                        skip=args.skip, target_fps=args.target_fps,
+                        profile=profile, profiles=ProfileStore(args.profile_dir))
+engine.warm_up(wait=False)
 
 # Get the list of available capture devices (comment out)
 #index = 0
@@ -48,417 +94,89 @@ drawing_spec = mp_drawing.DrawingSpec(thickness=1, circle_radius=1)
 #print(arr)
 
 # 3 - Open the video source
-cap = cv2.VideoCapture(0) # Local webcam (index start from 0)
-
-# 3.1 - Declaration of some variables and constants
-CALIBRATION_BUFFER_DIM = 30
-X = 0
-Y = 1
-OPEN_VAL = 0.32
-CLOSED_VAL = 0.02
-TEMPORAL_WINDOW_SECONDS = 10
-NORM_EAR_THRESHOLD = 0.68
-BLINK_DETECTION_SECONDS = 0.25
-
-
-normalized_EAR = deque()
-elapsed_time = deque()
-calib_index = 0
-pitch_calibration = np.zeros(CALIBRATION_BUFFER_DIM,dtype=float)
-yaw_calibration = np.zeros(CALIBRATION_BUFFER_DIM,dtype=float)
-distracted_time = 0
-
-
-
-# 4 - Iterate (within an infinite loop)
-while cap.isOpened(): 
-    
-    # 4.1 - Get the new frame
-    success, image = cap.read()
-
-    start = time.time()
-
-    # Also convert the color space from BGR to RGB
-    if image is None:
-        break
-        #continue
-    #else: #needed with some cameras/video input format
-        #image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
-        
-    # To improve performace
-    image.flags.writeable = False
-    
-    # 4.2 - Run MediaPipe on the frame
-    results = face_mesh.process(image)
-
-    # To improve performance
-    image.flags.writeable = True
-
-    # Convert the color space from RGB to BGR
-    #image = cv2.cvtColor(image, cv2.COLOR_RGB2BGR)
-    
-    img_h, img_w, img_c = image.shape
-
-
-    FONT_SCALE = 1.5 * 1e-3  # Adjust for larger font size in all images
-    font_scale = min(img_w, img_h) * FONT_SCALE
-    line_scale = min(img_w, img_h) * FONT_SCALE
-
-
-    point_RER = [] # Right Eye Right
-    point_REB = [] # Right Eye Bottom
-    point_REL = [] # Right Eye Left
-    point_RET = [] # Right Eye Top
-
-    point_LER = [] # Left Eye Right
-    point_LEB = [] # Left Eye Bottom
-    point_LEL = [] # Left Eye Left
-    point_LET = [] # Left Eye Top
-
-    point_REIC = [] # Right Eye Iris Center
-    point_LEIC = [] # Left Eye Iris Center
-
-    face_2d = []
-    face_3d = []
-    left_eye_2d = []
-    left_eye_3d = []
-    right_eye_2d = []
-    right_eye_3d = []
-    
-    eye_distraction = False
-
-    # 4.3 - Get the landmark coordinates
-    if results.multi_face_landmarks:
-        for face_landmarks in results.multi_face_landmarks:
-            for idx, lm in enumerate(face_landmarks.landmark):
-
-
-                # Eye Gaze (Iris Tracking)
-                # Left eye indices list
-                #LEFT_EYE =[ 362, 382, 381, 380, 374, 373, 390, 249, 263, 466, 388, 387, 386, 385,384, 398 ]
-                # Right eye indices list
-                #RIGHT_EYE=[ 33, 7, 163, 144, 145, 153, 154, 155, 133, 173, 157, 158, 159, 160, 161 , 246 ]
-                #LEFT_IRIS = [473, 474, 475, 476, 477]
-                #RIGHT_IRIS = [468, 469, 470, 471, 472]
-                if idx == 33:
-                    point_RER = (lm.x * img_w, lm.y * img_h)
-                    cv2.circle(image, (int(lm.x * img_w), int(lm.y * img_h)), radius=5, color=(0, 0, 255), thickness=-1)
-                if idx == 145:
-                    point_REB = (lm.x * img_w, lm.y * img_h)
-                    cv2.circle(image, (int(lm.x * img_w), int(lm.y * img_h)), radius=5, color=(0, 0, 255), thickness=-1)
-                if idx == 133:
-                    point_REL = (lm.x * img_w, lm.y * img_h)
-                    cv2.circle(image, (int(lm.x * img_w), int(lm.y * img_h)), radius=5, color=(0, 0, 255), thickness=-1)
-                if idx == 159:
-                    point_RET = (lm.x * img_w, lm.y * img_h)
-                    cv2.circle(image, (int(lm.x * img_w), int(lm.y * img_h)), radius=5, color=(0, 0, 255), thickness=-1)
-                if idx == 362:
-                    point_LER = (lm.x * img_w, lm.y * img_h)
-                    cv2.circle(image, (int(lm.x * img_w), int(lm.y * img_h)), radius=5, color=(0, 0, 255), thickness=-1)
-                if idx == 374:
-                    point_LEB = (lm.x * img_w, lm.y * img_h)
-                    cv2.circle(image, (int(lm.x * img_w), int(lm.y * img_h)), radius=5, color=(0, 0, 255), thickness=-1)
-                if idx == 263:
-                    point_LEL = (lm.x * img_w, lm.y * img_h)
-                    cv2.circle(image, (int(lm.x * img_w), int(lm.y * img_h)), radius=5, color=(0, 0, 255), thickness=-1)
-                if idx == 386:
-                    point_LET = (lm.x * img_w, lm.y * img_h)
-                    cv2.circle(image, (int(lm.x * img_w), int(lm.y * img_h)), radius=5, color=(0, 0, 255), thickness=-1)
-                if idx == 468:
-                    point_REIC = (lm.x * img_w, lm.y * img_h)
-                    #cv2.circle(image, (int(lm.x * img_w), int(lm.y * img_h)), radius=5, color=(255, 255, 0), thickness=-1)                    
-                if idx == 469:
-                    point_469 = (lm.x * img_w, lm.y * img_h)
-                    #cv2.circle(image, (int(lm.x * img_w), int(lm.y * img_h)), radius=5, color=(0, 255, 0), thickness=-1)
-                if idx == 470:
-                    point_470 = (lm.x * img_w, lm.y * img_h)
-                    #cv2.circle(image, (int(lm.x * img_w), int(lm.y * img_h)), radius=5, color=(0, 255, 0), thickness=-1)
-                if idx == 471:
-                    point_471 = (lm.x * img_w, lm.y * img_h)
-                    #cv2.circle(image, (int(lm.x * img_w), int(lm.y * img_h)), radius=5, color=(0, 255, 0), thickness=-1)
-                if idx == 472:
-                    point_472 = (lm.x * img_w, lm.y * img_h)
-                    #cv2.circle(image, (int(lm.x * img_w), int(lm.y * img_h)), radius=5, color=(0, 255, 0), thickness=-1)
-                if idx == 473:
-                    point_LEIC = (lm.x * img_w, lm.y * img_h)
-                    #cv2.circle(image, (int(lm.x * img_w), int(lm.y * img_h)), radius=5, color=(0, 255, 255), thickness=-1)
-                if idx == 474:
-                    point_474 = (lm.x * img_w, lm.y * img_h)
-                    #cv2.circle(image, (int(lm.x * img_w), int(lm.y * img_h)), radius=5, color=(255, 0, 0), thickness=-1)
-                if idx == 475:
-                    point_475 = (lm.x * img_w, lm.y * img_h)
-                    #cv2.circle(image, (int(lm.x * img_w), int(lm.y * img_h)), radius=5, color=(255, 0, 0), thickness=-1)
-                if idx == 476:
-                    point_476 = (lm.x * img_w, lm.y * img_h)
-                    #cv2.circle(image, (int(lm.x * img_w), int(lm.y * img_h)), radius=5, color=(255, 0, 0), thickness=-1)
-                if idx == 477:
-                    point_477 = (lm.x * img_w, lm.y * img_h)
-                    #cv2.circle(image, (int(lm.x * img_w), int(lm.y * img_h)), radius=5, color=(255, 0, 0), thickness=-1) 
-                
-
-
-                # face orientation
-                if idx == 33 or idx == 263 or idx == 1 or idx == 61 or idx == 291 or idx == 199:
-                    if idx == 1:
-                        nose_2d = (lm.x * img_w, lm.y * img_h)
-                        nose_3d = (lm.x * img_w, lm.y * img_h, lm.z * 3000)
-
-                    x, y = int(lm.x * img_w), int(lm.y * img_h)
-                    
-                    # Get the 2D Coordinates
-                    face_2d.append([x, y])
-                    # Get the 3D Coordinates
-                    face_3d.append([x, y, lm.z])
-
-                #LEFT_IRIS = [473, 474, 475, 476, 477]
-                if idx == 473 or idx == 362 or idx == 374 or idx == 263 or idx == 386: # iris points
-                #if idx == 473 or idx == 474 or idx == 475 or idx == 476 or idx == 477: # eye border
-                    if idx == 473:
-                        left_pupil_2d = (lm.x * img_w, lm.y * img_h)
-                        left_pupil_3d = (lm.x * img_w, lm.y * img_h, lm.z * 3000)
-                    
-                    x, y = int(lm.x * img_w), int(lm.y * img_h)
-                    left_eye_2d.append([x, y])
-                    left_eye_3d.append([x, y, lm.z])
-
-                #RIGHT_IRIS = [468, 469, 470, 471, 472]
-                if idx == 468 or idx == 33 or idx == 145 or idx == 133 or idx == 159: # iris points
-                # if idx == 468 or idx == 469 or idx == 470 or idx == 471 or idx == 472: # eye border
-                    if idx == 468:
-                        right_pupil_2d = (lm.x * img_w, lm.y * img_h)
-                        right_pupil_3d = (lm.x * img_w, lm.y * img_h, lm.z * 3000)
-                    
-                    x, y = int(lm.x * img_w), int(lm.y * img_h)
-                    right_eye_2d.append([x, y])
-                    right_eye_3d.append([x, y, lm.z]) 
-
-                # EAR
-                # Left eye
-                if idx==362:
-                    P1_left = (int(lm.x * img_w), int(lm.y * img_h))
-                if idx==385:
-                    P2_left = (int(lm.x * img_w), int(lm.y * img_h))
-                if idx==387:
-                    P3_left = (int(lm.x * img_w), int(lm.y * img_h))
-                if idx==263:
-                    P4_left = (int(lm.x * img_w), int(lm.y * img_h))
-                if idx==373:
-                    P5_left = (int(lm.x * img_w), int(lm.y * img_h))
-                if idx==380:
-                    P6_left = (int(lm.x * img_w), int(lm.y * img_h))
-
-                # Right eye
-                if idx==33:
-                    P1_right = (int(lm.x * img_w), int(lm.y * img_h))
-                if idx==160:
-                    P2_right = (int(lm.x * img_w), int(lm.y * img_h))
-                if idx==158:
-                    P3_right = (int(lm.x * img_w), int(lm.y * img_h))
-                if idx==133:
-                    P4_right = (int(lm.x * img_w), int(lm.y * img_h))
-                if idx==153:
-                    P5_right = (int(lm.x * img_w), int(lm.y * img_h))
-                if idx==144:
-                    P6_right = (int(lm.x * img_w), int(lm.y * img_h))
-
-
-            # 4.4. - Draw the positions on the frame
-            l_eye_width = point_LEL[0] - point_LER[0]
-            l_eye_height = point_LEB[1] - point_LET[1]
-            l_eye_center = [(point_LEL[0] + point_LER[0])/2 ,(point_LEB[1] + point_LET[1])/2]
-            #cv2.circle(image, (int(l_eye_center[0]), int(l_eye_center[1])), radius=int(horizontal_threshold * l_eye_width), color=(255, 0, 0), thickness=-1) #center of eye and its radius 
-            cv2.circle(image, (int(point_LEIC[0]), int(point_LEIC[1])), radius=3, color=(0, 255, 0), thickness=-1) # Center of iris
-            cv2.circle(image, (int(l_eye_center[0]), int(l_eye_center[1])), radius=2, color=(128, 128, 128), thickness=-1) # Center of eye
-            #print("Left eye: x = " + str(np.round(point_LEIC[0],0)) + " , y = " + str(np.round(point_LEIC[1],0)))
-            #cv2.putText(image, "Left eye:  x = " + str(np.round(point_LEIC[0],0)) + " , y = " + str(np.round(point_LEIC[1],0)), (50, 50), cv2.FONT_HERSHEY_SIMPLEX, font_scale, (0, 255, 0), 2) 
-
-            r_eye_width = point_REL[0] - point_RER[0]
-            r_eye_height = point_REB[1] - point_RET[1]
-            r_eye_center = [(point_REL[0] + point_RER[0])/2 ,(point_REB[1] + point_RET[1])/2]
-            #cv2.circle(image, (int(r_eye_center[0]), int(r_eye_center[1])), radius=int(horizontal_threshold * r_eye_width), color=(255, 0, 0), thickness=-1) #center of eye and its radius 
-            cv2.circle(image, (int(point_REIC[0]), int(point_REIC[1])), radius=2, color=(0, 255, 0), thickness=-1) # Center of iris
-            cv2.circle(image, (int(r_eye_center[0]), int(r_eye_center[1])), radius=2, color=(0, 0, 255), thickness=-1) # Center of eye
-            #print("right eye: x = " + str(np.round(point_REIC[0],0)) + " , y = " + str(np.round(point_REIC[1],0)))
-            #cv2.putText(image, "Right eye: x = " + str(np.round(point_REIC[0],0)) + " , y = " + str(np.round(point_REIC[1],0)), (50, 100), cv2.FONT_HERSHEY_SIMPLEX, font_scale, (0, 0, 255), 2) 
-
-            # speed reduction (comment out for full speed)
-            time.sleep(1/30) # [s]
-
-        
-        EAR_left  = (abs(P2_left[Y]-P6_left[Y]) + abs(P3_left[Y]-P5_left[Y]))/(2*abs(P1_left[X]-P4_left[X])) 
-        EAR_right = (abs(P2_right[Y]-P6_right[Y]) + abs(P3_right[Y]-P5_right[Y]))/(2*abs(P1_right[X]-P4_right[X]))
-        
-
-        ## Normalization into the [0;1] range
-        Left_open = (EAR_left-CLOSED_VAL)/(OPEN_VAL-CLOSED_VAL)
-        Right_open = (EAR_right-CLOSED_VAL)/(OPEN_VAL-CLOSED_VAL)
-
-        # DEBUG
-        #cv2.putText(image, "EAR Left eye: " + str(np.round(Left_open*100,2)), (25, int(img_h/2)), cv2.FONT_HERSHEY_SIMPLEX, font_scale, (0, 255, 0), 2) 
-        #cv2.putText(image, "EAR Right eye: " + str(np.round(Right_open*100,2)), (25, int(img_h/2)+40), cv2.FONT_HERSHEY_SIMPLEX, font_scale, (0, 255, 0), 2) 
-
-        
-        face_2d = np.array(face_2d, dtype=np.float64)
-        face_3d = np.array(face_3d, dtype=np.float64)
-        left_eye_2d = np.array(left_eye_2d, dtype=np.float64)
-        left_eye_3d = np.array(left_eye_3d, dtype=np.float64)
-        right_eye_2d = np.array(right_eye_2d, dtype=np.float64)
-        right_eye_3d = np.array(right_eye_3d, dtype=np.float64)
-
-        # The camera matrix
-        focal_length = 1 * img_w
-        cam_matrix = np.array([ [focal_length, 0, img_h / 2],
-        [0, focal_length, img_w / 2],
-        [0, 0, 1]])
-
-        # The distorsion parameters
-        dist_matrix = np.zeros((4, 1), dtype=np.float64)
-
-        
-        # Computation of rotation matrices
-        # There are the lines of code related to 3D eyes, however they are commented out as 2D eye gazing is used instead
-
-        # Solve PnP
-        success, rot_vec, trans_vec = cv2.solvePnP(face_3d, face_2d, cam_matrix, dist_matrix)
-        #success_left_eye, rot_vec_left_eye, trans_vec_left_eye = cv2.solvePnP(left_eye_3d, left_eye_2d, cam_matrix, dist_matrix)
-        #success_right_eye, rot_vec_right_eye, trans_vec_right_eye = cv2.solvePnP(right_eye_3d, right_eye_2d, cam_matrix, dist_matrix)
-
-
-        # Get rotational matrix
-        rmat, jac = cv2.Rodrigues(rot_vec)
-        #rmat_left_eye, jac_left_eye = cv2.Rodrigues(rot_vec_left_eye)
-        #rmat_right_eye, jac_right_eye = cv2.Rodrigues(rot_vec_right_eye)
-
-        # Get angles
-        angles, mtxR, mtxQ, Qx, Qy, Qz = cv2.RQDecomp3x3(rmat)
-        #angles_left_eye, mtxR_left_eye, mtxQ_left_eye, Qx_left_eye, Qy_left_eye, Qz_left_eye = cv2.RQDecomp3x3(rmat_left_eye)
-        #angles_right_eye, mtxR_right_eye, mtxQ_right_eye, Qx_right_eye, Qy_right_eye, Qz_right_eye = cv2.RQDecomp3x3(rmat_right_eye)
-
-        pitch = angles[0] * 1800
-        yaw = -angles[1] * 1800
-        roll = 180 + (np.arctan2(point_RER[1] - point_LEL[1], point_RER[0] - point_LEL[0]) * 180 / np.pi)
-        if roll > 180:
-            roll = roll - 360
-        
-        #pitch_left_eye = angles_left_eye[0] * 1800
-        #yaw_left_eye = angles_left_eye[1] * 1800
-        #pitch_right_eye = angles_right_eye[0] * 1800
-        #yaw_right_eye = angles_right_eye[1] * 1800
-        
-
-        ## Calibration array for pitch computation, as our webcam may not be at the same level of our head
-        ## => Our head's pitch is detected even when we are actually trying to look "straight ahead" 
-        ## It is calibrated based on an average of the pitch in the first 30 captured frames
-        ## In a real world application, calibration is static as we assume the camera stays fixed in place in the car
-        key = cv2.waitKey(1)
-        if calib_index < len(pitch_calibration) or key == 114 or key == 82:
-            cv2.putText(image, "Calibrating pitch and yaw", (15, 150), cv2.FONT_HERSHEY_SIMPLEX, font_scale, (0, 255, 255), 2)
-            
-            if key==114 or key==82: # Pressing r or R
-                pitch_calibration = np.zeros(CALIBRATION_BUFFER_DIM,dtype=float)
-                yaw_calibration = np.zeros(CALIBRATION_BUFFER_DIM,dtype=float)
-                calib_index = 0
-                pitch_constant = 0
-                yaw_constant = 0
-                key = 0
-            
-            pitch_calibration[calib_index] = pitch
-            yaw_calibration[calib_index] = yaw
-            calib_index += 1
-            pitch_constant = np.mean(pitch_calibration)
-            yaw_constant = np.mean(yaw_calibration)
-            
-
-        pitch = pitch - pitch_constant
-        yaw = yaw - yaw_constant
-
-
-        # DEBUG
-        #cv2.putText(image, "roll: " + str(np.round(roll, 4)), (15, 220), cv2.FONT_HERSHEY_SIMPLEX, font_scale, (0, 0, 255), 2)
-        #cv2.putText(image, "pitch: " + str(np.round(pitch, 4)), (15, 240), cv2.FONT_HERSHEY_SIMPLEX, font_scale, (0, 0, 255), 2)
-        #cv2.putText(image, "yaw: " + str(np.round(yaw, 4)), (15, 260), cv2.FONT_HERSHEY_SIMPLEX, font_scale, (0, 0, 255), 2)
-        
-        
-        ## Compute the 2D eyes gaze
-        ## Components are in the [-1;1] range, looking  RIGHT->left  or  DOWN (in theory) -> UP
-        eye_gaze_2d_right = ((point_REIC[X] - r_eye_center[X])/(r_eye_width/2), (point_REIC[Y] - r_eye_center[Y])/(r_eye_height/2))
-        eye_gaze_2d_left = ((point_LEIC[X] - l_eye_center[X])/(l_eye_width/2), (point_LEIC[Y] - l_eye_center[Y])/(l_eye_height/2))
-
-        # DEBUG
-        #cv2.putText(image, "REIC_Y: " + str(np.round(point_REIC[Y], 3)), (315, 140), cv2.FONT_HERSHEY_SIMPLEX, font_scale, (0, 0, 255), 2)
-        #cv2.putText(image, "RIGHT EYE CENTER y: " + str(np.round(r_eye_center[Y], 3)), (315, 160), cv2.FONT_HERSHEY_SIMPLEX, font_scale, (0, 0, 255), 2)
-        #cv2.putText(image, "R HEIGHT: " + str(np.round(r_eye_height, 3)), (315, 180), cv2.FONT_HERSHEY_SIMPLEX, font_scale, (0, 0, 255), 2)
-        
-        # DEBUG
-        #cv2.putText(image, "right_X: " + str(np.round(eye_gaze_2d_right[X], 3)), (15, 320), cv2.FONT_HERSHEY_SIMPLEX, font_scale, (0, 0, 255), 2)
-        #cv2.putText(image, "right_y: " + str(np.round(eye_gaze_2d_right[Y], 3)), (15, 340), cv2.FONT_HERSHEY_SIMPLEX, font_scale, (0, 0, 255), 2)
-        #cv2.putText(image, "left_X: " + str(np.round(eye_gaze_2d_left[X], 3)), (305, 320), cv2.FONT_HERSHEY_SIMPLEX, font_scale, (0, 0, 255), 2)
-        #cv2.putText(image, "left_y: " + str(np.round(eye_gaze_2d_left[Y], 3)), (305, 340), cv2.FONT_HERSHEY_SIMPLEX, font_scale, (0, 0, 255), 2)
-
-        # Display directions
-        nose_3d_projection, jacobian = cv2.projectPoints(nose_3d, rot_vec, trans_vec, cam_matrix, dist_matrix)
-        p1 = (int(nose_2d[0]), int(nose_2d[1]))
-        
-        p2 = (int(nose_2d[0] - yaw * line_scale), int(nose_2d[1] - pitch * line_scale))
-        cv2.line(image, p1, p2, (255, 0, 0), 3)
-
-
-        end = time.time()
-        totalTime = end-start
-
-        if totalTime>0:
-            fps = 1 / totalTime
-        else:
-            fps=0
-        
-        ## Drowsiness detection
-        while sum(elapsed_time) > TEMPORAL_WINDOW_SECONDS:
-            normalized_EAR.popleft()
-            elapsed_time.popleft()
-        
-        normalized_EAR.append(min(Left_open,Right_open))
-        elapsed_time.append(totalTime)
-
-        indices = [index for index, value in enumerate(normalized_EAR) if value < NORM_EAR_THRESHOLD]
-        selected_elements = [elapsed_time[index] for index in indices]
-        
-        MAX_INTERVAL = 0.8 * TEMPORAL_WINDOW_SECONDS # 80 %
-
-        closed_time = sum(selected_elements)
-        if closed_time >= MAX_INTERVAL:
-             cv2.putText(image, "Warning: Driver is drowsy", (15, 230), cv2.FONT_HERSHEY_SIMPLEX, font_scale, (0, 0, 255), 2)
-
-
-        ## Distraction detection
-        X_THRESHOLD = 0.25
-        Y_THRESHOLD = 0.25
-
-        if max(abs(eye_gaze_2d_right[X]),abs(eye_gaze_2d_left[X]))>X_THRESHOLD or max(abs(eye_gaze_2d_right[Y]),abs(eye_gaze_2d_left[Y]))>Y_THRESHOLD :
-            eye_distraction = True
-
-        if abs(roll)>30 or abs(pitch)>30 or abs(yaw)>30 or eye_distraction is True:
-            distracted=True
-        else:
-            distracted=False
-            distracted_time = 0
-
-        if distracted is True:
-            distracted_time = distracted_time + totalTime
-        if distracted_time > BLINK_DETECTION_SECONDS: # to avoid false positives due to blink
-            cv2.putText(image, "Warning: Driver is distracted", (15, 200), cv2.FONT_HERSHEY_SIMPLEX, font_scale, (0, 0, 255), 2)
-        
-        #print("FPS:", fps)
-
-        cv2.putText(image, f'FPS : {int(fps)}', (20,450), cv2.FONT_HERSHEY_SIMPLEX, 1.5, (0, 0, 255), 2)
-
-        # 4.5 - Show the frame to the user
-        cv2.imshow('Technologies for Autonomous Vehicles - Driver Monitoring Systems using AI code', image)       
-                    
-    if cv2.waitKey(5) & 0xFF == 27:
+cap = open_capture(args.source) # Local webcam (index start from 0)
+
+# 3.1 - Drowsiness and distraction state (calibration, temporal window, debounce)
+##     with several occupants, one such state per tracked face
+engine.ready()
+monitor = engine.monitor
+if engine.profile_loaded:
+    print(f"Calibration profile {profile} loaded", file=console(args.events))
+
+# 3.2 - Alert events for consumers outside this window, written by a background publisher
+publisher = alerts = None
+if args.events:
+    publisher = EventPublisher([sink_from_spec(spec) for spec in args.events]).start()
+    alerts = AlertTracker(stream_id=args.source, monitor=monitor)
+
+# 4 - Run capture and inference on their own threads, show the processed frames here
+pipeline = Pipeline(cap, engine.face_mesh, monitor, queue_size=args.queue_size, overflow=args.overflow).start()
+previous = None
+bus = None
+readers = []
+
+for frame in pipeline.frames():
+
+    # FPS of the presented stream and glass-to-display latency, from capture timestamps
+    fps = 0 if previous is None or frame.timestamp <= previous else 1 / (frame.timestamp - previous)
+    previous = frame.timestamp
+
+    if alerts is not None:
+        for event in alerts.update(frame.signals, frame.index, frame.timestamp):
+            publisher.publish(event)
+    engine.maybe_save_profile()
+
+    # 4.4 - Or hand the frame over to viewer/recorder processes, which draw it at their own pace
+    if args.bus:
+        if bus is None:
+            bus = FrameBus.create(frame.image.shape, args.bus)
+            viewer = [sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), "dm_framebus.py"), args.bus]
+            if args.viewer:
+                readers.append(subprocess.Popen(viewer))
+            if args.record:
+                readers.append(subprocess.Popen(viewer + ["--record", args.record, "--no-display"]))
+        start = METRICS.start()
+        bus.publish(frame.image, frame.index, frame.timestamp, frame.signals, fps=fps, latency=frame.age())
+        METRICS.stop("publish", start)
+        METRICS.record("latency", frame.age())
+        recalibrate, quit = bus.requests()
+        if quit:
+            break
+        if recalibrate:
+            monitor.recalibrate()
+        continue
+
+    # 4.5 - Show the frame to the user
+    if frame.signals is not None:
+        start = METRICS.start()
+        draw_overlay(frame.image, frame.signals, fps=fps, latency=frame.age())
+        METRICS.stop("draw", start)
+
+    start = METRICS.start()
+    if frame.signals is not None:
+        cv2.imshow('Technologies for Autonomous Vehicles - Driver Monitoring Systems using AI code', frame.image)
+    key = cv2.waitKey(1) & 0xFF
+    METRICS.stop("display", start)
+    METRICS.record("latency", frame.age())
+    if key == 27:
         break
+    if key == 114 or key == 82: # Pressing r or R
+        monitor.recalibrate()
 
 # 5 - Close properly soruce and eventual log file
+pipeline.stop()
 cap.release()
+engine.close() # saves the refined calibration
+if publisher is not None:
+    for event in alerts.close():
+        publisher.publish(event)
+    publisher.close()
+if bus is not None:
+    bus.close()
+    for reader in readers:
+        reader.wait()
+if args.metrics_json:
+    METRICS.dump_json(args.metrics_json)
 #log_file.close()
     
 # [EOF]
@@ -0,0 +1,436 @@
+#**************************************************************************************
+#
+#   Driver Monitoring Systems using AI
+#
+#   File: dm_bench.py
+#
+#   Reproducible benchmarks of the detection loop, without a webcam: landmark
+#   extraction, EAR, gaze, drowsiness window, pose and the whole detector are driven
+#   by landmark fixtures (recorded or synthetic), and the headless pipeline by a
+#   short synthetic video. Results can be saved as a baseline and compared to it.
+#
+#   Usage: python dm_bench.py [--fixture landmarks.npz] [--save baseline.json]
+#                             [--compare baseline.json --tolerance 0.15]
+#          python dm_bench.py --write-fixture landmarks.npz [--from-video video.mp4]
+#
+#**************************************************************************************
+
+import argparse
+import gc
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import cv2
+import numpy as np
+
+from dm_calibration import CALIBRATION_WINDOW
+from dm_detector import OPEN_VAL, CLOSED_VAL, DriverMonitor
+from dm_landmarks import (NUM_LANDMARKS, X, Y, eye_aspect_ratio, eye_gaze_2d,
+                          gather_points, head_roll, landmarks_to_array)
+from dm_pose import HeadPoseEstimator
+from dm_window import DrowsinessDetector
+
+FIXTURE_FRAMES = 900 # 30 s at 30 fps
+FIXTURE_FPS = 30
+FIXTURE_SIZE = (640, 480)
+VIDEO_FRAMES = 150
+TOLERANCE = 0.15     # Relative slowdown flagged as a regression
+REPEATS = 5          # Runs per benchmark, the median is kept
+ALLOC_FRAMES = 600   # Frames measured by the allocation check, after as many warm-up frames
+ALLOC_VIDEO_FRAMES = 480 # Frames of the video the allocation check runs the pipeline on
+ALLOC_FRAME_BUDGET = 8 * 1024     # [bytes] allocated while converting and detecting one frame
+ALLOC_PIPELINE_BUDGET = 16 * 1024 # [bytes] pipeline peak with its frames in flight, far below an image
+ALLOC_BUDGET = 64    # [bytes] retained per steady-state frame
+
+## Synthetic face: named points at plausible positions (normalized, 640x480 frame),
+## eyelid points move with the eye opening
+_EYE_POINTS = {
+    # index: (x, y, eyelid)  eyelid: -1 top lid, +1 bottom lid, 0 fixed
+    362: (0.56, 0.42, 0), 263: (0.66, 0.42, 0), 386: (0.61, 0.42, -1), 374: (0.61, 0.42, 1),
+    385: (0.59, 0.42, -1), 387: (0.63, 0.42, -1), 373: (0.63, 0.42, 1), 380: (0.59, 0.42, 1),
+    33: (0.34, 0.42, 0), 133: (0.44, 0.42, 0), 159: (0.39, 0.42, -1), 145: (0.39, 0.42, 1),
+    160: (0.37, 0.42, -1), 158: (0.41, 0.42, -1), 153: (0.41, 0.42, 1), 144: (0.37, 0.42, 1),
+    473: (0.61, 0.42, 0), 468: (0.39, 0.42, 0),
+    1: (0.50, 0.55, 0), 61: (0.43, 0.65, 0), 291: (0.57, 0.65, 0), 199: (0.50, 0.75, 0),
+}
+_LID_OPEN = 0.02 # normalized half eye opening of an open eye (EAR ~ 0.3)
+
+
+def synthetic_fixture(frames=FIXTURE_FRAMES, fps=FIXTURE_FPS, seed=0):
+    """Deterministic landmark fixture: one face with head motion, blinks and a few long
+    eye closures. Returns {landmarks (F, 1, 478, 3), faces (F,), timestamps (F,), img_w, img_h}."""
+    rng = np.random.default_rng(seed)
+    base = np.empty((NUM_LANDMARKS, 3), dtype=np.float64)
+    base[:, X] = rng.uniform(0.35, 0.65, NUM_LANDMARKS)
+    base[:, Y] = rng.uniform(0.30, 0.78, NUM_LANDMARKS)
+    base[:, 2] = rng.normal(0, 0.02, NUM_LANDMARKS)
+    lid = np.zeros(NUM_LANDMARKS)
+    for index, (x, y, eyelid) in _EYE_POINTS.items():
+        base[index, :2] = x, y
+        lid[index] = eyelid
+
+    t = np.arange(frames) / fps
+    opening = np.ones(frames)
+    opening[rng.random(frames) < 0.03] = 0.1               # blinks
+    for start in rng.integers(0, max(1, frames - 3 * fps), size=frames // (20 * fps)):
+        opening[start:start + 3 * fps] = 0.15                # closures
+    shift = np.stack([0.02 * np.sin(2 * np.pi * 0.1 * t), 0.01 * np.sin(2 * np.pi * 0.07 * t)], axis=1)
+
+    landmarks = np.repeat(base[None], frames, axis=0)
+    landmarks[:, :, Y] += lid[None, :] * _LID_OPEN * opening[:, None]
+    landmarks[:, :, :2] += shift[:, None, :] + rng.normal(0, 0.0005, (frames, NUM_LANDMARKS, 2))
+    return {
+        "landmarks": landmarks[:, None].astype(np.float32),
+        "faces": np.ones(frames, dtype=np.uint8),
+        "timestamps": t,
+        "img_w": FIXTURE_SIZE[0],
+        "img_h": FIXTURE_SIZE[1],
+    }
+
+
+def save_fixture(path, fixture):
+    np.savez_compressed(path, **fixture)
+
+
+def load_fixture(path):
+    """Fixture saved by save_fixture(), or exported from a landmark cache entry."""
+    with np.load(path) as data:
+        fixture = {name: data[name] for name in data.files}
+    fixture["img_w"] = int(fixture["img_w"])
+    fixture["img_h"] = int(fixture["img_h"])
+    return fixture
+
+
+def fixture_from_cache(entry):
+    """Fixture from a dm_cache.CacheEntry (recorded landmarks of a real video)."""
+    return {"landmarks": np.asarray(entry.landmarks), "faces": np.asarray(entry.faces),
+            "timestamps": np.asarray(entry.timestamps), "img_w": entry.img_w, "img_h": entry.img_h}
+
+
+class _Landmark:
+    __slots__ = ("x", "y", "z")
+
+    def __init__(self, x, y, z):
+        self.x, self.y, self.z = x, y, z
+
+
+class ReplayFaceMesh:
+    """Stands in for FaceMesh.process() by replaying fixture landmarks as MediaPipe-like
+    results, so the pipeline overhead can be measured without the model."""
+
+    def __init__(self, fixture):
+        self.frames = [self._results(fixture["landmarks"][i, :fixture["faces"][i]])
+                       for i in range(len(fixture["faces"]))]
+        self.index = 0
+
+    @staticmethod
+    def _results(faces):
+        class Face:
+            pass
+        multi = []
+        for face in faces:
+            result = Face()
+            result.landmark = [_Landmark(float(x), float(y), float(z)) for x, y, z in face]
+            multi.append(result)
+        results = Face()
+        results.multi_face_landmarks = multi or None
+        return results
+
+    def process(self, image):
+        results = self.frames[self.index % len(self.frames)]
+        self.index += 1
+        return results
+
+
+def _time(function, repeats=REPEATS):
+    """Median wall time [s] of function() over repeats runs, after one warm-up run."""
+    function()
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start)
+    return float(np.median(times))
+
+
+def _write_video(path, frames, size=FIXTURE_SIZE, fps=FIXTURE_FPS):
+    writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*"MJPG"), fps, size)
+    rng = np.random.default_rng(0)
+    image = rng.integers(0, 255, (size[1], size[0], 3), dtype=np.uint8)
+    for frame in range(frames):
+        writer.write(np.roll(image, frame, axis=1))
+    writer.release()
+
+
+def benchmarks(fixture, video_frames=VIDEO_FRAMES, facemesh=False, directory=None):
+    """{name: (function, operations per run)}; every function is deterministic. The
+    video benchmarks write their video into directory, and are left out without one."""
+    img_w, img_h = fixture["img_w"], fixture["img_h"]
+    faces = fixture["faces"]
+    landmarks = fixture["landmarks"][faces > 0, 0] # (F, 478, 3), one face per frame
+    frames = len(landmarks)
+    timestamps = fixture["timestamps"][faces > 0]
+    dt = np.diff(timestamps, prepend=timestamps[:1])
+    points = gather_points(landmarks, img_w, img_h)
+    eye_open = (eye_aspect_ratio(points) - CLOSED_VAL) / (OPEN_VAL - CLOSED_VAL)
+    replay = ReplayFaceMesh({"landmarks": landmarks[:200, None], "faces": np.ones(min(frames, 200), dtype=np.uint8)})
+    multi_face_landmarks = [result.multi_face_landmarks for result in replay.frames]
+
+    def extraction():
+        for multi in multi_face_landmarks:
+            landmarks_to_array(multi)
+
+    def gather_per_frame():
+        for frame in range(frames):
+            gather_points(landmarks[frame:frame + 1], img_w, img_h)
+
+    def signals_per_frame():
+        for frame in range(frames):
+            face_points = points[frame]
+            eye_aspect_ratio(face_points)
+            eye_gaze_2d(face_points)
+            head_roll(face_points)
+
+    def signals_batch():
+        eye_aspect_ratio(points)
+        eye_gaze_2d(points)
+        head_roll(points)
+
+    def drowsiness_window():
+        detector = DrowsinessDetector(windows=(10, 60))
+        for frame in range(frames):
+            detector.update(eye_open[frame, 0], eye_open[frame, 1], dt[frame])
+
+    def pose_per_frame():
+        estimator = HeadPoseEstimator()
+        for frame in range(frames):
+            estimator.estimate(points[frame], img_w, img_h)
+
+    def pose_batch():
+        HeadPoseEstimator().estimate_batch(points, img_w, img_h)
+
+    def detector():
+        monitor = DriverMonitor()
+        for frame in range(frames):
+            monitor.process(landmarks[frame:frame + 1], img_w, img_h, dt[frame])
+
+    # Four occupants side by side, the same face shifted
+    shifts = np.array([-0.3, -0.1, 0.1, 0.3])
+    occupants = np.repeat(landmarks[:, None], len(shifts), axis=1)
+    occupants[..., X] += shifts[None, :, None]
+
+    def occupants_detector():
+        from dm_occupants import OccupantMonitor
+        monitor = OccupantMonitor()
+        for frame in range(frames):
+            monitor.process(occupants[frame], img_w, img_h, dt[frame])
+
+    suite = {
+        "landmark_extraction": (extraction, len(multi_face_landmarks)),
+        "gather_points": (gather_per_frame, frames),
+        "ear_gaze_roll": (signals_per_frame, frames),
+        "ear_gaze_roll_batch": (signals_batch, frames),
+        "drowsiness_window": (drowsiness_window, frames),
+        "pose": (pose_per_frame, frames),
+        "pose_batch": (pose_batch, frames),
+        "detector": (detector, frames),
+        "detector_4_occupants": (occupants_detector, frames),
+    }
+
+    if video_frames and directory is not None:
+        video = os.path.join(directory, "synthetic.avi")
+        _write_video(video, video_frames)
+
+        video_mesh = ReplayFaceMesh(fixture)
+
+        def video_pipeline():
+            from dm_offline import process_video
+            video_mesh.index = 0
+            process_video(video, face_mesh=video_mesh)
+
+        suite["video_pipeline"] = (video_pipeline, video_frames)
+
+        if facemesh:
+            def video_facemesh():
+                from dm_offline import process_video
+                process_video(video)
+
+            suite["video_facemesh"] = (video_facemesh, video_frames)
+    return suite
+
+
+def run(fixture, only=None, repeats=REPEATS, video_frames=VIDEO_FRAMES, facemesh=False):
+    """{name: {"seconds": per run, "ops": operations per run, "us_per_op", "ops_per_s"}}"""
+    results = {}
+    with tempfile.TemporaryDirectory(prefix="dm-bench-") as directory:
+        for name, (function, ops) in benchmarks(fixture, video_frames, facemesh, directory).items():
+            if only and name not in only:
+                continue
+            seconds = _time(function, repeats)
+            results[name] = {"seconds": seconds, "ops": ops, "us_per_op": seconds / ops * 1e6,
+                             "ops_per_s": ops / seconds if seconds > 0 else float("inf")}
+    return results
+
+
+def allocations(fixture, frames=ALLOC_FRAMES, video_frames=ALLOC_VIDEO_FRAMES):
+    """Steady-state memory of the frame path, traced with tracemalloc once the
+    drowsiness window and the calibration medians are full (CALIBRATION_WINDOW frames).
+
+    frame_bytes: the largest tracemalloc peak of one frame of landmark conversion into
+    a reused buffer and detection (signals, pose, rules), i.e. what a frame allocates,
+    freed or not. Then the real Pipeline runs the same detector on a short synthetic
+    video (capture into recycled images with cap.read(image), FramePool, queues):
+    pipeline_peak_bytes is the peak over its measured frames, with several frames in
+    flight, and bytes_per_frame what those frames left allocated."""
+    from dm_pipeline import Pipeline, BLOCK, video_timebase
+
+    img_w, img_h = fixture["img_w"], fixture["img_h"]
+    faces = fixture["faces"]
+    replay = ReplayFaceMesh({"landmarks": fixture["landmarks"][faces > 0][:200], "faces": np.ones(min(int((faces > 0).sum()), 200), dtype=np.uint8)})
+    buffer = np.empty((1, NUM_LANDMARKS, 3), dtype=np.float32)
+    monitor = DriverMonitor()
+    dt = 1 / FIXTURE_FPS
+
+    def step(frame):
+        results = replay.frames[frame % len(replay.frames)]
+        landmarks = landmarks_to_array(results.multi_face_landmarks, buffer)
+        monitor.process(landmarks, img_w, img_h, dt)
+
+    warm_up = max(frames, CALIBRATION_WINDOW)
+    for frame in range(warm_up):
+        step(frame)
+    gc.collect()
+    tracemalloc.start()
+    frame_bytes = 0
+    for frame in range(warm_up, warm_up + frames):
+        before, _ = tracemalloc.get_traced_memory()
+        tracemalloc.reset_peak()
+        step(frame)
+        frame_bytes = max(frame_bytes, tracemalloc.get_traced_memory()[1] - before)
+    tracemalloc.stop()
+
+    # The pipeline, with the same warm detector, measured once its frame pool is full:
+    # the consumer stalls until both queues are, so every stage holds a frame at once.
+    # Traced from there on, so the interpreter's free lists emptied by gc.collect() are
+    # refilled, under tracing, before the baseline
+    fill = video_frames // 16
+    measured = range(video_frames // 2, video_frames - 1)
+    with tempfile.TemporaryDirectory(prefix="dm-bench-") as directory:
+        video = os.path.join(directory, "allocations.avi")
+        _write_video(video, video_frames)
+        cap = cv2.VideoCapture(video)
+        pipeline = Pipeline(cap, replay, monitor, queue_size=2, overflow=BLOCK, timebase=video_timebase).start()
+        try:
+            for frame in pipeline.frames():
+                if frame.index == fill:
+                    queues = (pipeline.captured, pipeline.processed)
+                    while any(len(queue) < queue.maxsize for queue in queues):
+                        time.sleep(0.001)
+                    gc.collect()
+                    tracemalloc.start()
+                elif frame.index == measured.start:
+                    base, _ = tracemalloc.get_traced_memory()
+                    tracemalloc.reset_peak()
+                elif frame.index == measured.stop:
+                    current, peak = tracemalloc.get_traced_memory()
+                    tracemalloc.stop()
+        finally:
+            pipeline.stop()
+            cap.release()
+    return {"frames": frames, "frame_bytes": frame_bytes, "pipeline_frames": len(measured),
+            "bytes_per_frame": (current - base) / len(measured), "pipeline_peak_bytes": peak - base}
+
+
+def environment():
+    return {"python": sys.version.split()[0], "numpy": np.__version__, "opencv": cv2.__version__,
+            "platform": platform.platform(), "machine": platform.machine(), "cpus": os.cpu_count()}
+
+
+def compare(results, baseline, tolerance=TOLERANCE):
+    """[(name, baseline us/op, current us/op, relative change)] of the regressions."""
+    regressions = []
+    for name, current in results.items():
+        reference = baseline.get("results", {}).get(name)
+        if reference is None:
+            continue
+        change = current["us_per_op"] / reference["us_per_op"] - 1
+        if change > tolerance:
+            regressions.append((name, reference["us_per_op"], current["us_per_op"], change))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks of the driver monitor")
+    parser.add_argument("--fixture", default=None, help="landmark fixture (.npz), default: synthetic")
+    parser.add_argument("--write-fixture", default=None, help="save a fixture to this file and exit")
+    parser.add_argument("--from-video", default=None,
+                        help="with --write-fixture: record the fixture from the cached landmarks of this video")
+    parser.add_argument("--only", nargs="*", default=None, help="benchmarks to run (default: all)")
+    parser.add_argument("--repeats", type=int, default=REPEATS, help="runs per benchmark, the median is kept")
+    parser.add_argument("--video-frames", type=int, default=VIDEO_FRAMES, help="frames of the synthetic video (0: skip)")
+    parser.add_argument("--facemesh", action="store_true", help="also run MediaPipe end to end on the video")
+    parser.add_argument("--allocations", action="store_true",
+                        help="also check that the steady-state frame path allocates and retains (almost) no memory")
+    parser.add_argument("--save", default=None, help="write the results as a JSON baseline")
+    parser.add_argument("--compare", default=None, help="JSON baseline to compare with")
+    parser.add_argument("--tolerance", type=float, default=TOLERANCE, help="relative slowdown flagged (default: %(default)s)")
+    args = parser.parse_args()
+
+    if args.write_fixture:
+        if args.from_video:
+            from dm_cache import LandmarkCache
+            from dm_detector import FACE_MESH_SETTINGS
+            entry = LandmarkCache().get(args.from_video, FACE_MESH_SETTINGS)
+            if entry is None:
+                print(f"no cached landmarks for {args.from_video!r}, run dm_offline.py on it first")
+                return 1
+            save_fixture(args.write_fixture, fixture_from_cache(entry))
+        else:
+            save_fixture(args.write_fixture, synthetic_fixture())
+        return 0
+
+    fixture = load_fixture(args.fixture) if args.fixture else synthetic_fixture()
+    results = run(fixture, args.only, args.repeats, args.video_frames, args.facemesh)
+
+    print(f"{'benchmark':<22} {'us/op':>10} {'ops/s':>12}")
+    for name, result in results.items():
+        print(f"{name:<22} {result['us_per_op']:10.2f} {result['ops_per_s']:12.0f}")
+
+    status = 0
+    memory = None
+    if args.allocations:
+        memory = allocations(fixture)
+        print(f"allocations: {memory['frame_bytes']} bytes per frame at most over {memory['frames']} frames; "
+              f"pipeline {memory['pipeline_peak_bytes']} bytes peak, {memory['bytes_per_frame']:.1f} bytes "
+              f"retained per frame over {memory['pipeline_frames']} frames")
+        for name, budget, unit in (("frame_bytes", ALLOC_FRAME_BUDGET, "allocated per frame"),
+                                   ("pipeline_peak_bytes", ALLOC_PIPELINE_BUDGET, "peak in the pipeline"),
+                                   ("bytes_per_frame", ALLOC_BUDGET, "retained per frame")):
+            if memory[name] > budget:
+                print(f"ALLOCATIONS above the budget of {budget} bytes {unit}")
+                status = 1
+
+    if args.save:
+        with open(args.save, "w") as out:
+            json.dump({"environment": environment(), "fixture": args.fixture or "synthetic",
+                       "results": results, "allocations": memory}, out, indent=1)
+
+    if args.compare:
+        with open(args.compare) as baseline_file:
+            baseline = json.load(baseline_file)
+        regressions = compare(results, baseline, args.tolerance)
+        for name, reference, current, change in regressions:
+            print(f"REGRESSION {name}: {reference:.2f} -> {current:.2f} us/op (+{change * 100:.0f}%)")
+        if regressions:
+            return 1
+        print(f"no regression beyond {args.tolerance * 100:.0f}%")
+    return status
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,233 @@
+#**************************************************************************************
+#
+#   Driver Monitoring Systems using AI
+#
+#   File: dm_cache.py
+#
+#   On-disk landmark cache: the raw FaceMesh landmarks of a video, keyed by video
+#   content hash and FaceMesh settings, stored as memory-mapped float32 arrays.
+#   Offline runs replay them instead of decoding the video and running MediaPipe.
+#
+#**************************************************************************************
+
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+
+import numpy as np
+
+from dm_landmarks import NUM_LANDMARKS
+
+CACHE_VERSION = 1 # Bump when the stored layout or the landmark model changes
+DEFAULT_CACHE_DIR = os.environ.get("DM_CACHE_DIR",
+                                   os.path.join(os.path.expanduser("~"), ".cache", "dm-ai", "landmarks"))
+DEFAULT_MAX_BYTES = 10 * 1024 ** 3 # 10 GB
+
+HASH_CHUNK = 4 * 1024 * 1024
+HASH_INDEX = "hashes.json" # path -> (size, mtime_ns, digest), so unchanged videos aren't re-hashed
+META = "meta.json"
+LANDMARKS = "landmarks.f32" # raw float32, shape in META
+
+
+def settings_key(settings):
+    """Stable digest of the FaceMesh settings."""
+    blob = json.dumps(settings, sort_keys=True).encode()
+    return hashlib.sha256(blob).hexdigest()[:16]
+
+
+class CacheEntry:
+    """A cached video: landmarks (F, max_num_faces, 478, 3) float32 memmap, faces (F,)
+    number of faces per frame, timestamps (F,) [s], frame size and FaceMesh settings."""
+
+    def __init__(self, directory, meta):
+        self.directory = directory
+        self.meta = meta
+        self.img_w = meta["img_w"]
+        self.img_h = meta["img_h"]
+        self.settings = meta["settings"]
+        shape = (meta["frames"], meta["max_num_faces"], NUM_LANDMARKS, 3)
+        self.landmarks = np.memmap(os.path.join(directory, LANDMARKS), dtype=np.float32, mode="r", shape=shape) \
+            if meta["frames"] else np.empty(shape, dtype=np.float32)
+        self.faces = np.load(os.path.join(directory, "faces.npy"))
+        self.timestamps = np.load(os.path.join(directory, "timestamps.npy"))
+
+    def __len__(self):
+        return len(self.timestamps)
+
+    def frame(self, index):
+        """(N_faces, 478, 3) landmarks of one frame, as landmarks_to_array() returns them."""
+        return self.landmarks[index, :self.faces[index]]
+
+
+class LandmarkWriter:
+    """Streams the landmarks of a run to a staging directory, frame after frame.
+    Get one from LandmarkCache.writer() and hand it back to LandmarkCache.put()."""
+
+    def __init__(self, staging, max_num_faces):
+        self.staging = staging
+        self.max_num_faces = max_num_faces
+        self.faces = []
+        self.timestamps = []
+        self.img_w = self.img_h = 0
+        self._frame = np.zeros((max_num_faces, NUM_LANDMARKS, 3), dtype=np.float32)
+        self._file = open(os.path.join(staging, LANDMARKS), "wb")
+
+    def add(self, timestamp, landmarks, img_w, img_h):
+        n_faces = min(len(landmarks), self.max_num_faces)
+        self._frame[:n_faces] = landmarks[:n_faces]
+        self._frame[n_faces:] = 0
+        self._file.write(self._frame.data)
+        self.faces.append(n_faces)
+        self.timestamps.append(timestamp)
+        self.img_w, self.img_h = img_w, img_h
+
+    def append(self, path, faces, timestamps, img_w, img_h):
+        """Append the frames streamed to another writer's landmark file (a chunk of the
+        video processed elsewhere), with its per-frame faces and timestamps."""
+        with open(path, "rb") as chunk:
+            shutil.copyfileobj(chunk, self._file, HASH_CHUNK)
+        self.faces.extend(faces)
+        self.timestamps.extend(timestamps)
+        if len(timestamps):
+            self.img_w, self.img_h = img_w, img_h
+
+    def close(self):
+        self._file.close()
+
+    def finish(self, settings):
+        """Close the writer and save the per-frame arrays next to the landmarks. The
+        staging directory is then a CacheEntry of the returned meta (LandmarkCache.put
+        also writes it to META and moves the directory into the cache)."""
+        self.close()
+        np.save(os.path.join(self.staging, "faces.npy"), np.asarray(self.faces, dtype=np.uint8))
+        np.save(os.path.join(self.staging, "timestamps.npy"), np.asarray(self.timestamps, dtype=np.float64))
+        return {
+            "version": CACHE_VERSION,
+            "settings": settings,
+            "frames": len(self.timestamps),
+            "max_num_faces": self.max_num_faces,
+            "img_w": self.img_w,
+            "img_h": self.img_h,
+        }
+
+    def abort(self):
+        self.close()
+        shutil.rmtree(self.staging, ignore_errors=True)
+
+
+class LandmarkCache:
+    """Directory of cached videos, capped at max_bytes with least-recently-used eviction.
+
+    An entry is found only for the same video content *and* the same FaceMesh
+    settings, so changing refine_landmarks, the confidences or max_num_faces misses
+    the cache; entries written by another CACHE_VERSION are dropped when met."""
+
+    def __init__(self, directory=DEFAULT_CACHE_DIR, max_bytes=DEFAULT_MAX_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        os.makedirs(directory, exist_ok=True)
+
+    def video_hash(self, path):
+        """sha256 of the video content, memoized on (size, mtime) of the file."""
+        stat = os.stat(path)
+        index_path = os.path.join(self.directory, HASH_INDEX)
+        try:
+            with open(index_path) as index_file:
+                index = json.load(index_file)
+        except (OSError, ValueError):
+            index = {}
+
+        key = os.path.abspath(path)
+        known = index.get(key)
+        if known and known[0] == stat.st_size and known[1] == stat.st_mtime_ns:
+            return known[2]
+
+        digest = hashlib.sha256()
+        with open(path, "rb") as video:
+            for chunk in iter(lambda: video.read(HASH_CHUNK), b""):
+                digest.update(chunk)
+        index[key] = (stat.st_size, stat.st_mtime_ns, digest.hexdigest())
+        self._write_json(index_path, index)
+        return index[key][2]
+
+    def entry_dir(self, video_hash, settings):
+        return os.path.join(self.directory, f"{video_hash[:32]}-{settings_key(settings)}")
+
+    def get(self, path, settings):
+        """CacheEntry of the video for these FaceMesh settings, or None."""
+        directory = self.entry_dir(self.video_hash(path), settings)
+        try:
+            with open(os.path.join(directory, META)) as meta_file:
+                meta = json.load(meta_file)
+        except (OSError, ValueError):
+            return None
+        if meta.get("version") != CACHE_VERSION or meta.get("settings") != settings:
+            shutil.rmtree(directory, ignore_errors=True)
+            return None
+        os.utime(os.path.join(directory, META)) # LRU: last use is the meta mtime
+        return CacheEntry(directory, meta)
+
+    def writer(self, max_num_faces):
+        """LandmarkWriter staging a new entry; an interrupted run leaves no entry behind."""
+        return LandmarkWriter(tempfile.mkdtemp(prefix=".staging-", dir=self.directory), max_num_faces)
+
+    def put(self, path, settings, writer):
+        """Turn the landmarks streamed by a LandmarkWriter into the entry of the video for
+        these settings (replacing any previous one), then enforce the size cap."""
+        video_hash = self.video_hash(path)
+        directory = self.entry_dir(video_hash, settings)
+        try:
+            meta = writer.finish(settings)
+            self._write_json(os.path.join(writer.staging, META),
+                             {**meta, "video": os.path.abspath(path), "video_hash": video_hash})
+            shutil.rmtree(directory, ignore_errors=True)
+            os.replace(writer.staging, directory)
+        except BaseException:
+            writer.abort()
+            raise
+
+        self.evict(keep=directory)
+        return CacheEntry(directory, self._read_meta(directory))
+
+    def invalidate(self, path):
+        """Drop the entries of a video, whatever their settings."""
+        prefix = self.video_hash(path)[:32] + "-"
+        for name in os.listdir(self.directory):
+            if name.startswith(prefix):
+                shutil.rmtree(os.path.join(self.directory, name), ignore_errors=True)
+
+    def entries(self):
+        """(last use, size in bytes, directory) of every entry, least recently used first."""
+        entries = []
+        for name in os.listdir(self.directory):
+            directory = os.path.join(self.directory, name)
+            meta = os.path.join(directory, META)
+            if name.startswith(".") or not os.path.isfile(meta):
+                continue
+            size = sum(os.path.getsize(os.path.join(directory, f)) for f in os.listdir(directory))
+            entries.append((os.path.getmtime(meta), size, directory))
+        return sorted(entries)
+
+    def evict(self, keep=None):
+        """Remove least recently used entries until the cache fits in max_bytes."""
+        entries = self.entries()
+        total = sum(size for _, size, _ in entries)
+        for _, size, directory in entries:
+            if total <= self.max_bytes:
+                break
+            if directory == keep:
+                continue
+            shutil.rmtree(directory, ignore_errors=True)
+            total -= size
+
+    def _read_meta(self, directory):
+        with open(os.path.join(directory, META)) as meta_file:
+            return json.load(meta_file)
+
+    def _write_json(self, path, data):
+        tmp = path + ".tmp"
+        with open(tmp, "w") as out:
+            json.dump(data, out)
+        os.replace(tmp, path)
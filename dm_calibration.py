@@ -0,0 +1,166 @@
+#**************************************************************************************
+#
+#   Driver Monitoring Systems using AI
+#
+#   File: dm_calibration.py
+#
+#   Head pose calibration: the rest pitch/yaw of the driver, estimated with running
+#   medians that keep refining while driving, and saved to disk as profiles keyed by
+#   camera/vehicle/driver so a restart starts calibrated.
+#
+#**************************************************************************************
+
+import json
+import os
+import re
+import threading
+import time
+
+from bisect import bisect_left, insort
+from collections import deque
+
+CALIBRATION_MIN_SAMPLES = 30  # Samples before a fresh calibration is trusted (the original 30 frames)
+CALIBRATION_WINDOW = 900      # Samples the running medians are taken over (~30 s at 30 fps)
+CALIBRATION_GATE = 30         # [deg] once calibrated, poses further than this from rest aren't rest samples
+PROFILE_SAMPLES = 300         # Latest samples saved with a profile, to seed the medians at the next start
+DEFAULT_PROFILE_DIR = os.environ.get("DM_PROFILE_DIR",
+                                     os.path.join(os.path.expanduser("~"), ".config", "dm-ai", "profiles"))
+
+
+class RunningMedian:
+    """Median of the last `window` values, updated in O(window) without sorting."""
+
+    def __init__(self, window=CALIBRATION_WINDOW):
+        self.window = window
+        self._values = deque()
+        self._sorted = []
+
+    def __len__(self):
+        return len(self._values)
+
+    def push(self, value):
+        if len(self._values) >= self.window:
+            del self._sorted[bisect_left(self._sorted, self._values.popleft())]
+        self._values.append(value)
+        insort(self._sorted, value)
+
+    def median(self):
+        n = len(self._sorted)
+        if not n:
+            return 0.0
+        if n % 2:
+            return self._sorted[n // 2]
+        return (self._sorted[n // 2 - 1] + self._sorted[n // 2]) / 2
+
+    def values(self):
+        return list(self._values)
+
+    def clear(self):
+        self._values.clear()
+        self._sorted.clear()
+
+
+class HeadCalibration:
+    """Rest pitch/yaw of the driver, subtracted from the measured angles.
+
+    Every pose within `gate` degrees of the current rest pose is a sample; the rest
+    pose is the running median of the samples, so glances to the mirrors or a turned
+    head don't move it. Until min_samples have been seen (and no profile was loaded)
+    the calibration is flagged as in progress, and every pose is a sample.
+
+    The methods hold a lock, so state() can be taken on another thread than the one
+    updating: its samples are always (pitch, yaw) pairs of the same frames."""
+
+    def __init__(self, window=CALIBRATION_WINDOW, min_samples=CALIBRATION_MIN_SAMPLES, gate=CALIBRATION_GATE):
+        self.min_samples = min_samples
+        self.gate = gate
+        self._pitch = RunningMedian(window)
+        self._yaw = RunningMedian(window)
+        self.pitch_constant = 0.0
+        self.yaw_constant = 0.0
+        self.calibrated = False
+        self._fresh = 0 # samples since the last reset
+        self._lock = threading.Lock()
+
+    def update(self, pitch, yaw):
+        """(pitch, yaw) relative to the rest pose, and whether calibration is in progress."""
+        with self._lock:
+            calibrating = not self.calibrated
+            if calibrating or (abs(pitch - self.pitch_constant) <= self.gate and abs(yaw - self.yaw_constant) <= self.gate):
+                self._pitch.push(float(pitch))
+                self._yaw.push(float(yaw))
+                self._fresh += 1
+                self.pitch_constant = self._pitch.median()
+                self.yaw_constant = self._yaw.median()
+                if self._fresh >= self.min_samples:
+                    self.calibrated = True
+            return pitch - self.pitch_constant, yaw - self.yaw_constant, calibrating
+
+    def reset(self):
+        """Start over (the camera moved, or another driver): the samples are dropped."""
+        with self._lock:
+            self._reset()
+
+    def _reset(self):
+        self._pitch.clear()
+        self._yaw.clear()
+        self._fresh = 0
+        self.calibrated = False
+
+    def state(self, samples=PROFILE_SAMPLES):
+        """JSON-friendly state, for a profile: a consistent snapshot."""
+        with self._lock:
+            return {
+                "pitch": self.pitch_constant,
+                "yaw": self.yaw_constant,
+                "calibrated": self.calibrated,
+                "samples": [list(sample) for sample in zip(self._pitch.values(), self._yaw.values())][-samples:],
+            }
+
+    def load(self, state):
+        """Resume from a saved state: calibrated at once, and still refined online."""
+        with self._lock:
+            self._reset()
+            for pitch, yaw in state.get("samples", ()):
+                self._pitch.push(float(pitch))
+                self._yaw.push(float(yaw))
+            if len(self._pitch):
+                self.pitch_constant = self._pitch.median()
+                self.yaw_constant = self._yaw.median()
+            else:
+                self.pitch_constant = float(state["pitch"])
+                self.yaw_constant = float(state["yaw"])
+            self.calibrated = bool(state.get("calibrated", True))
+            self._fresh = len(self._pitch)
+
+
+def profile_key(camera=None, vehicle=None, driver=None):
+    """Profile name of a camera/vehicle/driver triple; missing parts are "default"."""
+    parts = [str(part) if part not in (None, "") else "default" for part in (vehicle, camera, driver)]
+    return "-".join(re.sub(r"[^A-Za-z0-9_.]+", "_", part) for part in parts)
+
+
+class ProfileStore:
+    """Calibration profiles, one JSON file per key in a directory."""
+
+    def __init__(self, directory=DEFAULT_PROFILE_DIR):
+        self.directory = directory
+
+    def path(self, key):
+        return os.path.join(self.directory, key + ".json")
+
+    def load(self, key):
+        """The saved calibration state of key, or None."""
+        try:
+            with open(self.path(key)) as profile:
+                return json.load(profile)["calibration"]
+        except (OSError, ValueError, KeyError):
+            return None
+
+    def save(self, key, state):
+        os.makedirs(self.directory, exist_ok=True)
+        path = self.path(key)
+        tmp = path + ".tmp"
+        with open(tmp, "w") as profile:
+            json.dump({"key": key, "saved": time.time(), "calibration": state}, profile)
+        os.replace(tmp, path)
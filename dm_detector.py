@@ -0,0 +1,143 @@
+#**************************************************************************************
+#
+#   Driver Monitoring Systems using AI
+#
+#   File: dm_detector.py
+#
+#   Drowsiness and distraction detection state, fed with one landmark array per frame.
+#
+#**************************************************************************************
+
+from collections import namedtuple
+
+from dm_calibration import HeadCalibration
+from dm_landmarks import LEFT, RIGHT, X, Y, gather_points, eye_aspect_ratio, eye_gaze_2d, head_roll
+from dm_metrics import METRICS
+from dm_pose import HeadPoseEstimator
+from dm_window import MIN_EAR, TEMPORAL_WINDOW_SECONDS, DrowsinessDetector
+
+# Declaration of some constants
+OPEN_VAL = 0.32
+CLOSED_VAL = 0.02
+BLINK_DETECTION_SECONDS = 0.25
+X_THRESHOLD = 0.25
+Y_THRESHOLD = 0.25
+HEAD_POSE_LIMIT = 30 # [deg]
+
+
+Signals = namedtuple("Signals", [
+    "points",          # (N_faces, len(INDICES), 3) gathered points, x/y in pixels
+    "ear",             # (2,) EAR, indexed by LEFT/RIGHT
+    "eye_open",        # (2,) EAR normalized into the [0;1] range
+    "gaze",            # (2, 2) 2D eye gaze, indexed by LEFT/RIGHT then X/Y
+    "pitch", "yaw", "roll",
+    "calibrating",
+    "closed_time",     # [s] with the eyes closed in the drowsiness window
+    "perclos",         # fraction of the drowsiness window with the eyes closed
+    "drowsy",
+    "distracted_time",
+    "distracted",
+])
+
+
+# FaceMesh settings (they also key the landmark cache, see dm_cache.py)
+FACE_MESH_SETTINGS = {
+    "max_num_faces": 1,
+    "refine_landmarks": True, # Enables  detailed eyes points
+    "min_detection_confidence": 0.5,
+    "min_tracking_confidence": 0.5,
+}
+
+
+def create_face_mesh(**settings):
+    """Build a MediaPipe FaceMesh; settings override FACE_MESH_SETTINGS."""
+    import mediapipe as mp
+    return mp.solutions.face_mesh.FaceMesh(**{**FACE_MESH_SETTINGS, **settings})
+
+
+class DriverMonitor:
+    """Per-driver detection state: pitch/yaw calibration, the drowsiness window and
+    the distraction debounce. Call process() once per frame with the frame interval.
+
+    drowsiness_mode and windows are passed to DrowsinessDetector (see dm_window.py);
+    calibration is a HeadCalibration, e.g. loaded from a profile."""
+
+    def __init__(self, drowsiness_mode=MIN_EAR, windows=(TEMPORAL_WINDOW_SECONDS,), calibration=None):
+        self.drowsiness = DrowsinessDetector(drowsiness_mode, windows)
+        self.pose = HeadPoseEstimator()
+        self.calibration = HeadCalibration() if calibration is None else calibration
+        self.distracted_time = 0
+        self._recalibrate = False
+
+    def recalibrate(self):
+        """Throw away the pitch/yaw calibration at the next processed frame ('r' key)."""
+        self._recalibrate = True
+
+    def calibrate(self, pitch, yaw):
+        ## Calibration of pitch and yaw, as our webcam may not be at the same level of our head
+        ## => Our head's pitch is detected even when we are actually trying to look "straight ahead"
+        ## The rest pose is the running median of the poses close to it (see dm_calibration.py),
+        ## taken from the first frames, or loaded from a saved profile, and refined while driving
+        if self._recalibrate:
+            self.calibration.reset()
+            self._recalibrate = False
+        return self.calibration.update(pitch, yaw)
+
+    def distraction(self, gaze, pitch, yaw, roll, dt):
+        ## Distraction detection
+        eye_distraction = (max(abs(gaze[RIGHT][X]), abs(gaze[LEFT][X])) > X_THRESHOLD
+                           or max(abs(gaze[RIGHT][Y]), abs(gaze[LEFT][Y])) > Y_THRESHOLD)
+
+        if abs(roll) > HEAD_POSE_LIMIT or abs(pitch) > HEAD_POSE_LIMIT or abs(yaw) > HEAD_POSE_LIMIT or eye_distraction:
+            self.distracted_time = self.distracted_time + dt
+        else:
+            self.distracted_time = 0
+
+        return self.distracted_time > BLINK_DETECTION_SECONDS # to avoid false positives due to blink
+
+    def process(self, landmarks, img_w, img_h, dt, pose=None):
+        """Run the detection on a (N_faces, 478, 3) landmark array.
+
+        dt is the time [s] elapsed since the previous processed frame; pose is an
+        optional precomputed (pitch, yaw), e.g. from HeadPoseEstimator.estimate_batch().
+        Returns a Signals record, or None when no face was found (the state is left
+        untouched, but the next pose solve starts cold)."""
+        if not len(landmarks):
+            self.pose.reset()
+            return None
+
+        start = METRICS.start()
+        points = gather_points(landmarks, img_w, img_h)
+        # As before, the last detected face drives the detection
+        face_points = points[-1]
+
+        ear = eye_aspect_ratio(face_points)
+        ## Normalization into the [0;1] range
+        eye_open = (ear - CLOSED_VAL) / (OPEN_VAL - CLOSED_VAL)
+        roll = head_roll(face_points)
+
+        ## Compute the 2D eyes gaze
+        ## Components are in the [-1;1] range, looking  RIGHT->left  or  DOWN (in theory) -> UP
+        gaze = eye_gaze_2d(face_points)
+        METRICS.stop("signals", start)
+
+        start = METRICS.start()
+        pitch, yaw = self.pose.estimate(face_points, img_w, img_h) if pose is None else pose
+        METRICS.stop("pose", start)
+
+        start = METRICS.start()
+        signals = self.rules(points, ear, eye_open, gaze, pitch, yaw, roll, dt)
+        METRICS.stop("rules", start)
+        return signals
+
+    def rules(self, points, ear, eye_open, gaze, pitch, yaw, roll, dt):
+        """Calibration, drowsiness window and distraction debounce on the signals of
+        one face; returns its Signals record."""
+        pitch, yaw, calibrating = self.calibrate(pitch, yaw)
+
+        ## Drowsiness detection
+        closed_time, perclos, drowsy = self.drowsiness.update(eye_open[LEFT], eye_open[RIGHT], dt)
+        distracted = self.distraction(gaze, pitch, yaw, roll, dt)
+
+        return Signals(points, ear, eye_open, gaze, pitch, yaw, roll, calibrating,
+                       closed_time, perclos, drowsy, self.distracted_time, distracted)
@@ -0,0 +1,138 @@
+#**************************************************************************************
+#
+#   Driver Monitoring Systems using AI
+#
+#   File: dm_engine.py
+#
+#   Detector engine: FaceMesh (with the optional crop and frame skipping stages) and the
+#   detection state, built on first use and warmed up before the first real frame, with
+#   the head pose calibration loaded from and saved to a profile.
+#
+#**************************************************************************************
+
+import threading
+import time
+
+import numpy as np
+
+from dm_calibration import DEFAULT_PROFILE_DIR, HeadCalibration, ProfileStore
+from dm_detector import DriverMonitor, create_face_mesh
+from dm_landmarks import detect_landmarks
+from dm_occupants import OccupantMonitor
+from dm_roi import FaceROI, ROI_SIZE
+from dm_scheduler import FrameScheduler
+from dm_window import MIN_EAR
+
+WARMUP_SHAPE = (480, 640, 3) # Frames the models are warmed up with
+WARMUP_FRAMES = 3            # The first inferences of a graph are the slow ones
+PROFILE_SAVE_INTERVAL = 60.0 # [s] between two saves of a refined calibration
+
+
+class DetectorEngine:
+    """Everything the inference stage needs, built lazily: face_mesh (the object given
+    to Pipeline) and monitor (DriverMonitor, or OccupantMonitor with occupants > 1).
+
+    warm_up() builds them and runs the first, slow inferences on blank frames, in the
+    background if asked so it overlaps opening the camera. With a profile key, the
+    driver's calibration is loaded from the ProfileStore and saved back by
+    maybe_save_profile() and close(); profiles are not used with several occupants."""
+
+    def __init__(self, drowsiness_mode=MIN_EAR, occupants=1, roi=False, roi_size=ROI_SIZE, latency_budget=None,
+                 skip=1, target_fps=None, profile=None, profiles=None, **settings):
+        self.drowsiness_mode = drowsiness_mode
+        self.occupants = occupants
+        self.roi = roi
+        self.roi_size = roi_size
+        self.latency_budget = latency_budget # [s]
+        self.skip = skip
+        self.target_fps = target_fps
+        self.profile = profile if occupants == 1 else None
+        self.profiles = profiles if profiles is not None else ProfileStore(DEFAULT_PROFILE_DIR)
+        self.settings = {"max_num_faces": occupants, **settings}
+        self.profile_loaded = False
+        self._model = None      # the bare FaceMesh
+        self._face_mesh = None  # with the crop/skip stages around it
+        self._monitor = None
+        self._lock = threading.Lock()
+        self._warm_up = None
+        self._saved = None      # monotonic time of the last profile save
+
+    @property
+    def face_mesh(self):
+        with self._lock:
+            if self._face_mesh is None:
+                self._model = create_face_mesh(**self.settings)
+                face_mesh = self._model
+                if self.roi:
+                    face_mesh = FaceROI(face_mesh, size=self.roi_size, latency_budget=self.latency_budget,
+                                        max_faces=self.occupants)
+                if self.skip > 1 or self.target_fps:
+                    face_mesh = FrameScheduler(face_mesh, k=self.skip, target_fps=self.target_fps)
+                self._face_mesh = face_mesh
+            return self._face_mesh
+
+    @property
+    def monitor(self):
+        if self._monitor is None:
+            if self.occupants > 1:
+                self._monitor = OccupantMonitor(drowsiness_mode=self.drowsiness_mode)
+            else:
+                self._monitor = DriverMonitor(drowsiness_mode=self.drowsiness_mode, calibration=self._calibration())
+        return self._monitor
+
+    def _calibration(self):
+        calibration = HeadCalibration()
+        state = None if self.profile is None else self.profiles.load(self.profile)
+        if state is not None:
+            calibration.load(state)
+            self.profile_loaded = True
+        return calibration
+
+    def warm_up(self, shape=WARMUP_SHAPE, frames=WARMUP_FRAMES, wait=True):
+        """Build FaceMesh and the detection state and run the first inferences on blank
+        frames of shape; with wait=False this runs on a thread, see ready()."""
+        self._warm_up = threading.Thread(target=self._run_warm_up, args=(shape, frames), name="warm-up", daemon=True)
+        self._warm_up.start()
+        if wait:
+            self.ready()
+        return self
+
+    def _run_warm_up(self, shape, frames):
+        self.face_mesh
+        self.monitor
+        image = np.zeros(shape, dtype=np.uint8)
+        for _ in range(frames):
+            # The bare model: the crop and skip stages keep state about the real frames
+            detect_landmarks(self._model, image)
+
+    def ready(self):
+        """Wait for a warm-up started with wait=False."""
+        if self._warm_up is not None:
+            self._warm_up.join()
+            self._warm_up = None
+        return self
+
+    def save_profile(self):
+        """Save the driver's calibration to its profile, once there is one to save; from
+        any thread, the calibration state is snapshotted under its lock."""
+        if self.profile is None or self._monitor is None or not self._monitor.calibration.calibrated:
+            return False
+        self.profiles.save(self.profile, self._monitor.calibration.state())
+        self._saved = time.monotonic()
+        return True
+
+    def maybe_save_profile(self, now=None, interval=PROFILE_SAVE_INTERVAL):
+        """save_profile() every interval [s], so the online refinements survive a crash."""
+        now = time.monotonic() if now is None else now
+        if self._saved is None:
+            self._saved = now
+        elif now - self._saved >= interval:
+            self.save_profile()
+            self._saved = now
+
+    def close(self):
+        self.ready()
+        self.save_profile()
+        if self._model is not None:
+            self._model.close()
+
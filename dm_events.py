@@ -0,0 +1,456 @@
+#**************************************************************************************
+#
+#   Driver Monitoring Systems using AI
+#
+#   File: dm_events.py
+#
+#   Structured alert events for consumers outside the window (fleet backend, buzzer,
+#   logger): drowsy/distracted start and stop events with the metrics behind them,
+#   published as JSON lines by an asyncio loop on its own thread, in batches, to
+#   pluggable sinks. The detection loop only appends to a bounded queue.
+#
+#   Usage: python dm_events.py listen /tmp/dm-events.sock   (local socket consumer)
+#
+#**************************************************************************************
+
+import argparse
+import asyncio
+import json
+import os
+import stat
+import sys
+import threading
+import time
+
+from collections import deque
+
+ALERTS = ("drowsy", "distracted")
+EVENT_QUEUE_SIZE = 4096 # Events waiting to be written; the oldest are dropped beyond it
+BATCH_SIZE = 256        # Events that wake the writer before the flush interval
+FLUSH_INTERVAL = 0.1    # [s] between two writes when events are few
+SINK_TIMEOUT = 1.0      # [s] a sink may take to accept a batch
+SINK_BUFFER_LIMIT = 1 << 20 # [bytes] a socket consumer may leave unread before it's disconnected
+RECONNECT_INTERVAL = 1.0
+COALESCED = ("stats",)  # Event types of which only the latest per stream is kept in a batch
+
+
+def _metrics(signals):
+    """The values behind the alerts, as JSON-friendly numbers."""
+    return {
+        "closed_time": float(signals.closed_time),
+        "perclos": float(signals.perclos),
+        "distracted_time": float(signals.distracted_time),
+        "pitch": float(signals.pitch),
+        "yaw": float(signals.yaw),
+        "roll": float(signals.roll),
+        "gaze": [[float(v) for v in eye] for eye in signals.gaze],
+        "eye_open": [float(v) for v in signals.eye_open],
+    }
+
+
+class AlertTracker:
+    """Turns the per-frame Signals of one stream into alert start/stop events.
+
+    update() takes a Signals record, the {ID: Signals} of an OccupantMonitor, or None
+    (no face). Alerts stop when the state of the face says so: a frame without the
+    face changes nothing, since the detector keeps its state across it. The alerts of
+    an occupant stop when its track is dropped, read from monitor.dropped (see
+    OccupantMonitor), and close() stops the ones still active at the end of the stream."""
+
+    def __init__(self, stream_id=None, monitor=None):
+        self.stream_id = stream_id
+        self.monitor = monitor
+        self.active = {} # (occupant, alert) -> timestamp of the start
+        self._last = (None, 0.0) # frame index and timestamp of the last update
+
+    def update(self, signals, frame_index, timestamp):
+        if signals is None:
+            occupants = {}
+        elif isinstance(signals, dict):
+            occupants = signals
+        else:
+            occupants = {None: signals}
+        self._last = (frame_index, timestamp)
+
+        events = []
+        for occupant, face_signals in occupants.items():
+            for name in ALERTS:
+                key = (occupant, name)
+                state = bool(getattr(face_signals, name))
+                if state and key not in self.active:
+                    self.active[key] = timestamp
+                    events.append(self._event(occupant, name, "start", frame_index, timestamp, face_signals))
+                elif not state and key in self.active:
+                    events.append(self._event(occupant, name, "stop", frame_index, timestamp, face_signals))
+
+        dropped = getattr(self.monitor, "dropped", None)
+        while dropped:
+            occupant = dropped.popleft()
+            events.extend(self._stop(occupant, frame_index, timestamp))
+        return events
+
+    def close(self):
+        """Stop events for the alerts still active, at the last updated frame."""
+        frame_index, timestamp = self._last
+        events = []
+        for occupant in {occupant for occupant, _ in self.active}:
+            events.extend(self._stop(occupant, frame_index, timestamp))
+        return events
+
+    def _stop(self, occupant, frame_index, timestamp):
+        return [self._event(occupant, name, "stop", frame_index, timestamp, None)
+                for name in ALERTS if (occupant, name) in self.active]
+
+    def _event(self, occupant, name, state, frame_index, timestamp, signals):
+        event = {
+            "type": "alert",
+            "alert": name,
+            "state": state,
+            "stream": self.stream_id,
+            "occupant": occupant,
+            "frame": frame_index,
+            "timestamp": float(timestamp),
+            "time": time.time(),
+            "metrics": None if signals is None else _metrics(signals),
+        }
+        if state == "stop":
+            event["duration"] = float(timestamp - self.active.pop((occupant, name)))
+        return event
+
+
+## Sinks: write(data) gets a batch of JSON lines as bytes
+
+class BlockingSink:
+    """Base of the sinks whose writes block (pipes, files): they run on a daemon thread
+    so a stalled one can't hold the event loop up, nor the exit of the process. A
+    batch that comes while the previous write is still stuck is lost for this sink."""
+
+    _writing = None
+
+    async def _run(self, function, *args):
+        if self._writing is not None and not self._writing.done():
+            raise OSError(f"{self.name} is still writing the previous batch")
+        loop = asyncio.get_running_loop()
+        future = self._writing = loop.create_future()
+
+        def settle(error):
+            if not future.done():
+                if error is None:
+                    future.set_result(None)
+                else:
+                    future.set_exception(error)
+
+        def write():
+            try:
+                function(*args)
+                error = None
+            except Exception as exception:
+                error = exception
+            try:
+                loop.call_soon_threadsafe(settle, error)
+            except RuntimeError:
+                pass # the loop is closed, nobody waits anymore
+
+        threading.Thread(target=write, name=f"sink {self.name}", daemon=True).start()
+        await asyncio.shield(future) # a timeout gives up waiting, the write goes on
+
+
+class StdoutSink(BlockingSink):
+    name = "stdout"
+
+    async def open(self):
+        pass
+
+    async def write(self, data):
+        await self._run(self._write, data)
+
+    def _write(self, data):
+        sys.stdout.buffer.write(data)
+        sys.stdout.flush()
+
+    async def close(self):
+        pass
+
+
+class FileSink(BlockingSink):
+    """Append-only JSON lines file."""
+
+    def __init__(self, path):
+        self.path = path
+        self.name = f"file:{path}"
+        self._file = None
+
+    async def open(self):
+        self._file = open(self.path, "ab")
+
+    async def write(self, data):
+        if self._file is None:
+            raise OSError(f"cannot open {self.path}")
+        await self._run(self._write, data)
+
+    def _write(self, data):
+        self._file.write(data)
+        self._file.flush()
+
+    async def close(self):
+        # Closing would wait for a stuck write, it is left to the process exit then
+        if self._file is not None and (self._writing is None or self._writing.done()):
+            self._file.close()
+
+
+class UnixSocketSink:
+    """Local UNIX socket consumer, (re)connected on demand; batches written while it's
+    unreachable are lost for this sink. A consumer that stops reading is disconnected,
+    its unread data discarded, when a batch times out or more than buffer_limit bytes
+    are still waiting for it: the transport buffer can't grow without bound."""
+
+    def __init__(self, path, reconnect_interval=RECONNECT_INTERVAL, buffer_limit=SINK_BUFFER_LIMIT):
+        self.path = path
+        self.name = f"unix:{path}"
+        self.reconnect_interval = reconnect_interval
+        self.buffer_limit = buffer_limit
+        self._writer = None
+        self._last_attempt = None
+
+    async def open(self):
+        await self._connect()
+
+    async def _connect(self):
+        now = time.monotonic()
+        if self._last_attempt is not None and now - self._last_attempt < self.reconnect_interval:
+            return
+        self._last_attempt = now
+        try:
+            _, self._writer = await asyncio.open_unix_connection(self.path)
+        except OSError:
+            self._writer = None
+
+    async def write(self, data):
+        if self._writer is None:
+            await self._connect()
+            if self._writer is None:
+                raise ConnectionError(f"{self.path} unreachable")
+        if self._writer.transport.get_write_buffer_size() > self.buffer_limit:
+            self._disconnect()
+            raise ConnectionError(f"{self.path} isn't reading")
+        try:
+            self._writer.write(data)
+            await self._writer.drain()
+        except (OSError, ConnectionError, asyncio.CancelledError):
+            # CancelledError: the SINK_TIMEOUT of the publisher, the buffer would only grow
+            self._disconnect()
+            raise
+
+    def _disconnect(self):
+        self._writer.transport.abort() # drops what is buffered, close() would flush it
+        self._writer = None
+
+    async def close(self):
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+
+
+def sink_from_spec(spec):
+    """"stdout" (or "-"), "file:PATH" or "unix:PATH"."""
+    if spec in ("stdout", "-"):
+        return StdoutSink()
+    kind, _, path = spec.partition(":")
+    if kind == "file" and path:
+        return FileSink(path)
+    if kind == "unix" and path:
+        return UnixSocketSink(path)
+    raise ValueError(f"unknown event sink {spec!r} (stdout, file:PATH or unix:PATH)")
+
+
+def console(specs):
+    """Where human-readable output goes: stderr when a sink of specs writes the
+    JSON lines to stdout, so that stream stays parseable; stdout otherwise."""
+    return sys.stderr if any(spec in ("stdout", "-") for spec in specs or ()) else sys.stdout
+
+
+class EventPublisher:
+    """Writes events to the sinks from an asyncio loop on a daemon thread.
+
+    publish() never blocks: events go to a bounded queue. When it's full, the events
+    of the COALESCED types are dropped first, then the oldest; drops are counted. The
+    loop writes the events in batches, every flush_interval or as soon as batch_size
+    are waiting. Within a batch, events of the COALESCED types
+    keep only their latest per stream. A failing or slow sink (SINK_TIMEOUT) loses that
+    batch, counted in sink_errors, without holding back the others: blocking writes
+    (stdout, files) run on their own threads, see BlockingSink.
+
+    "publisher" start and stop events, the latter with the counters, frame the stream.
+    Events published after close() are counted as dropped."""
+
+    def __init__(self, sinks, maxsize=EVENT_QUEUE_SIZE, batch_size=BATCH_SIZE, flush_interval=FLUSH_INTERVAL):
+        self.sinks = list(sinks)
+        self.maxsize = maxsize
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.published = 0
+        self.dropped = 0      # queue overflow
+        self.coalesced = 0
+        self.written = 0      # events written to every sink
+        self.sink_errors = {sink.name: 0 for sink in self.sinks}
+        self._pending = deque()
+        self._lock = threading.Lock()
+        self._loop = None
+        self._wakeup = None
+        self._thread = None
+        self._closing = False
+        self._closed = False  # the loop is gone: nothing more is written
+        self._signaled = False
+
+    def start(self):
+        started = threading.Event()
+        self._thread = threading.Thread(target=self._run, args=(started,), name="events", daemon=True)
+        self._thread.start()
+        started.wait()
+        self.publish({"type": "publisher", "state": "start", "time": time.time(),
+                      "sinks": [sink.name for sink in self.sinks]})
+        return self
+
+    def publish(self, event):
+        """Queue an event (a JSON-serializable dict); safe from any thread."""
+        with self._lock:
+            self.published += 1
+            if self._closed:
+                self.dropped += 1
+                return
+            if len(self._pending) >= self.maxsize:
+                self.dropped += 1
+                if event.get("type") in COALESCED:
+                    return # a newer one will follow
+                self._drop_oldest()
+            self._pending.append(event)
+            if len(self._pending) >= min(self.batch_size, self.maxsize) and not self._signaled:
+                # Under the lock: the loop can't be closed meanwhile
+                self._signaled = True
+                self._loop.call_soon_threadsafe(self._wakeup.set)
+
+    def _drop_oldest(self):
+        """Make room for an event: the oldest of the COALESCED types if any, else the oldest."""
+        for position, pending in enumerate(self._pending):
+            if pending.get("type") in COALESCED:
+                del self._pending[position]
+                return
+        self._pending.popleft()
+
+    def stats(self):
+        return {"published": self.published, "dropped": self.dropped, "coalesced": self.coalesced,
+                "written": self.written, "queued": len(self._pending), "sink_errors": dict(self.sink_errors)}
+
+    def close(self, timeout=5.0):
+        """Write what is queued, then a "publisher" stop event, and stop the loop."""
+        if self._thread is None:
+            return
+        self.publish({"type": "publisher", "state": "stop", "time": time.time(), **self.stats()})
+        self._closing = True
+        self._loop.call_soon_threadsafe(self._wakeup.set)
+        self._thread.join(timeout)
+        self._thread = None
+
+    def _run(self, started):
+        self._loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self._loop)
+        self._wakeup = asyncio.Event()
+        started.set()
+        try:
+            self._loop.run_until_complete(self._serve())
+        finally:
+            with self._lock:
+                self._closed = True
+            self._loop.close()
+
+    async def _serve(self):
+        for sink in self.sinks:
+            try:
+                await sink.open()
+            except OSError:
+                self.sink_errors[sink.name] += 1
+        try:
+            while True:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), self.flush_interval)
+                except asyncio.TimeoutError:
+                    pass
+                self._wakeup.clear()
+                closing = self._closing
+                batch = self._take()
+                if batch:
+                    await self._write(batch)
+                if closing and not self._pending:
+                    break
+        finally:
+            for sink in self.sinks:
+                await sink.close()
+
+    def _take(self):
+        with self._lock:
+            events = list(self._pending)
+            self._pending.clear()
+            self._signaled = False
+        latest = {}
+        for position, event in enumerate(events):
+            if event.get("type") in COALESCED:
+                latest[(event["type"], event.get("stream"))] = position
+        if len(latest) == sum(event.get("type") in COALESCED for event in events):
+            return events
+        batch = [event for position, event in enumerate(events)
+                 if event.get("type") not in COALESCED or latest[(event["type"], event.get("stream"))] == position]
+        self.coalesced += len(events) - len(batch)
+        return batch
+
+    async def _write(self, batch):
+        data = b"".join(json.dumps(event, separators=(",", ":")).encode() + b"\n" for event in batch)
+        failed = False
+        for sink in self.sinks:
+            try:
+                await asyncio.wait_for(sink.write(data), SINK_TIMEOUT)
+            except (OSError, ConnectionError, asyncio.TimeoutError):
+                self.sink_errors[sink.name] += 1
+                failed = True
+        if not failed:
+            self.written += len(batch)
+
+
+def listen(path, on_event=None):
+    """Local stand-in for an event consumer: a UNIX socket server calling on_event(dict)
+    for every event received (default: print it). Runs until interrupted."""
+    if on_event is None:
+        on_event = lambda event: print(json.dumps(event), flush=True)
+
+    async def handle(reader, writer):
+        while True:
+            line = await reader.readline()
+            if not line:
+                break
+            on_event(json.loads(line))
+        writer.close()
+
+    async def serve():
+        if os.path.exists(path) and stat.S_ISSOCK(os.stat(path).st_mode):
+            os.unlink(path) # left by a previous listener
+        server = await asyncio.start_unix_server(handle, path)
+        async with server:
+            await server.serve_forever()
+
+    try:
+        asyncio.run(serve())
+    except KeyboardInterrupt:
+        pass
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Driver monitor events")
+    commands = parser.add_subparsers(dest="command", required=True)
+    listener = commands.add_parser("listen", help="print the events received on a UNIX socket")
+    listener.add_argument("path", help="socket path, as given to --events unix:PATH")
+    args = parser.parse_args()
+    if args.command == "listen":
+        listen(args.path)
+
+
+if __name__ == "__main__":
+    main()
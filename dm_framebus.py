@@ -0,0 +1,258 @@
+#**************************************************************************************
+#
+#   Driver Monitoring Systems using AI
+#
+#   File: dm_framebus.py
+#
+#   Shared-memory frame bus: the detector publishes raw frames and their overlay
+#   description into a ring of slots, viewers and recorders in other processes render
+#   them at their own pace. Publishing never waits for a reader: a slow reader skips
+#   the frames that were overwritten.
+#
+#   Usage: python dm_framebus.py NAME [--record video.avi] [--fps 30]
+#
+#**************************************************************************************
+
+import argparse
+import time
+
+import cv2
+import numpy as np
+
+from multiprocessing import resource_tracker, shared_memory
+
+from dm_overlay import OVERLAY_DTYPE, describe_overlay, render_overlay
+
+BUS_NAME = "dm-ai-frames"
+BUS_SLOTS = 8
+BUS_MAGIC = 0x444D4642 # "DMFB"
+ATTACH_TIMEOUT = 10.0  # [s] a reader waits this long for the bus to appear
+POLL_INTERVAL = 0.002  # [s] between two checks of a reader waiting for a frame
+RECORD_FPS = 30
+ALIGN = 64
+
+HEADER_DTYPE = np.dtype([
+    ("magic", np.uint32),
+    ("slots", np.uint32),
+    ("height", np.uint32),
+    ("width", np.uint32),
+    ("channels", np.uint32),
+    ("closed", np.uint32),       # set by the publisher when it stops
+    ("latest", np.int64),        # sequence number of the last complete frame, -1 before the first
+    ("quit", np.uint32),         # set by a viewer (Esc)
+    ("recalibrate", np.uint32),  # incremented by a viewer ('r')
+])
+
+SLOT_DTYPE = np.dtype([
+    ("seq", np.int64),           # sequence number of the frame in the slot, -1 while written
+    ("index", np.int64),
+    ("timestamp", np.float64),
+    ("overlay", OVERLAY_DTYPE),
+])
+
+
+def _aligned(size):
+    return (size + ALIGN - 1) // ALIGN * ALIGN
+
+
+def _attach(name):
+    """Open an existing segment without letting this process' resource tracker unlink
+    it at exit (only the publisher owns it)."""
+    try:
+        return shared_memory.SharedMemory(name=name, track=False) # Python >= 3.13
+    except TypeError:
+        shm = shared_memory.SharedMemory(name=name)
+        resource_tracker.unregister(shm._name, "shared_memory")
+        return shm
+
+
+class FrameBus:
+    """Ring of BUS_SLOTS (frame, overlay) slots in one shared memory segment.
+
+    The single publisher writes slot seq % slots and commits it by storing seq in the
+    slot header, then in the bus header; it never waits. Readers copy a slot out and
+    check its sequence number again to reject a slot overwritten meanwhile.
+
+    Use FrameBus.create() in the detector and FrameBus.attach() in the readers."""
+
+    def __init__(self, shm, owner):
+        self.shm = shm
+        self.owner = owner
+        self.header = np.ndarray((), dtype=HEADER_DTYPE, buffer=shm.buf)
+        slots = int(self.header["slots"])
+        shape = (slots, int(self.header["height"]), int(self.header["width"]), int(self.header["channels"]))
+        offset = _aligned(HEADER_DTYPE.itemsize)
+        self.meta = np.ndarray((slots,), dtype=SLOT_DTYPE, buffer=shm.buf, offset=offset)
+        offset += _aligned(SLOT_DTYPE.itemsize * slots)
+        self.images = np.ndarray(shape, dtype=np.uint8, buffer=shm.buf, offset=offset)
+        self.published = 0
+        self.skipped = 0         # frames a reader missed because they were overwritten
+        self._recalibrate = int(self.header["recalibrate"])
+
+    @classmethod
+    def create(cls, shape, name=BUS_NAME, slots=BUS_SLOTS):
+        """New bus for frames of the given (height, width, channels) shape."""
+        height, width, channels = shape if len(shape) == 3 else (*shape, 1)
+        size = (_aligned(HEADER_DTYPE.itemsize) + _aligned(SLOT_DTYPE.itemsize * slots)
+                + slots * height * width * channels)
+        try:
+            shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+        except FileExistsError:
+            # Left behind by a publisher that didn't stop properly
+            stale = _attach(name)
+            stale.close()
+            stale.unlink()
+            shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+        header = np.ndarray((), dtype=HEADER_DTYPE, buffer=shm.buf)
+        header[()] = (BUS_MAGIC, slots, height, width, channels, 0, -1, 0, 0)
+        del header
+        bus = cls(shm, owner=True)
+        bus.meta["seq"] = -1
+        return bus
+
+    @classmethod
+    def attach(cls, name=BUS_NAME, timeout=ATTACH_TIMEOUT):
+        """Attach to the bus of a running publisher, waiting for it up to timeout [s]."""
+        deadline = time.monotonic() + timeout
+        while True:
+            try:
+                shm = _attach(name)
+                if np.ndarray((), dtype=HEADER_DTYPE, buffer=shm.buf)["magic"] == BUS_MAGIC:
+                    return cls(shm, owner=False)
+                shm.close()
+            except FileNotFoundError:
+                pass
+            if time.monotonic() > deadline:
+                raise TimeoutError(f"no frame bus {name!r}")
+            time.sleep(0.1)
+
+    @property
+    def shape(self):
+        return self.images.shape[1:]
+
+    ## Publisher side
+
+    def publish(self, image, index, timestamp, signals=None, fps=None, latency=None):
+        """Copy a frame and the description of its overlay into the next slot."""
+        seq = int(self.header["latest"]) + 1
+        slot = seq % len(self.meta)
+        meta = self.meta[slot]
+        meta["seq"] = -1
+        self.images[slot] = image.reshape(self.shape)
+        overlay = meta["overlay"]
+        if signals is None:
+            overlay["n_faces"] = 0
+            overlay["fps"] = np.nan if fps is None else fps
+            overlay["latency"] = np.nan if latency is None else latency
+        else:
+            describe_overlay(overlay, signals, self.shape[1], self.shape[0], fps, latency)
+        meta["index"] = index
+        meta["timestamp"] = timestamp
+        meta["seq"] = seq
+        self.header["latest"] = seq
+        self.published += 1
+
+    def requests(self):
+        """(recalibrate, quit) requested by the viewers since the last call."""
+        count = int(self.header["recalibrate"])
+        recalibrate, self._recalibrate = count != self._recalibrate, count
+        return recalibrate, bool(self.header["quit"])
+
+    ## Reader side
+
+    def read(self, after=-1, latest=True):
+        """(seq, index, timestamp, image, overlay) of a frame newer than seq `after`,
+        copied out of the bus, or None if there is none yet. latest=True jumps to the
+        newest frame (display); latest=False returns the next one still in the ring
+        (recording), counting the overwritten ones in skipped."""
+        newest = int(self.header["latest"])
+        if newest <= after:
+            return None
+        seq = newest if latest else self._oldest(after, newest)
+        while True:
+            slot = seq % len(self.meta)
+            image = self.images[slot].copy()
+            meta = self.meta[slot].copy()
+            if self.meta[slot]["seq"] == seq and meta["seq"] == seq:
+                if not latest:
+                    self.skipped += seq - after - 1
+                return seq, int(meta["index"]), float(meta["timestamp"]), image, meta["overlay"]
+            # Overwritten while copying: retry with the newest frame, or the oldest one left
+            newest = int(self.header["latest"])
+            seq = newest if latest else self._oldest(seq, newest)
+
+    def _oldest(self, after, newest):
+        """The oldest seq newer than `after` still safe to read: the slot after newest
+        is the next one the publisher overwrites."""
+        return max(after + 1, newest - max(len(self.meta) - 2, 0))
+
+    def request(self, recalibrate=False, quit=False):
+        if recalibrate:
+            self.header["recalibrate"] += 1
+        if quit:
+            self.header["quit"] = 1
+
+    @property
+    def closed(self):
+        return bool(self.header["closed"])
+
+    def close(self):
+        if self.owner:
+            self.header["closed"] = 1
+        del self.header, self.meta, self.images
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
+
+
+def view(name=BUS_NAME, record=None, fps=RECORD_FPS, display=True):
+    """Render the frames of a bus: in a window (latest frame, Esc quits the detector,
+    'r' recalibrates it) and/or into a video file (every frame still in the ring)."""
+    bus = FrameBus.attach(name)
+    writer = None
+    if record:
+        height, width = bus.shape[:2]
+        writer = cv2.VideoWriter(record, cv2.VideoWriter_fourcc(*"MJPG"), fps, (width, height))
+    seq = -1
+    try:
+        while True:
+            frame = bus.read(seq, latest=writer is None)
+            if frame is None:
+                if bus.closed:
+                    break
+                time.sleep(POLL_INTERVAL)
+                continue
+            seq, index, timestamp, image, overlay = frame
+            render_overlay(image, overlay)
+            if writer is not None:
+                writer.write(image)
+            if display:
+                cv2.imshow('Technologies for Autonomous Vehicles - Driver Monitoring Systems using AI code', image)
+                key = cv2.waitKey(1) & 0xFF
+                if key == 27:
+                    bus.request(quit=True)
+                    break
+                if key == 114 or key == 82: # Pressing r or R
+                    bus.request(recalibrate=True)
+    finally:
+        if writer is not None:
+            writer.release()
+        skipped = bus.skipped
+        bus.close()
+    return skipped
+
+
+def main():
+    parser = argparse.ArgumentParser(description="View or record the frames published by dm-AI.py --bus")
+    parser.add_argument("name", nargs="?", default=BUS_NAME, help="frame bus name (default: %(default)s)")
+    parser.add_argument("--record", default=None, help="encode the frames into this video file")
+    parser.add_argument("--fps", type=float, default=RECORD_FPS, help="frame rate of the recording")
+    parser.add_argument("--no-display", action="store_true", help="don't open a window (recording only)")
+    args = parser.parse_args()
+    skipped = view(args.name, args.record, args.fps, display=not args.no_display)
+    if args.record:
+        print(f"{skipped} frames skipped")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,200 @@
+#**************************************************************************************
+#
+#   Driver Monitoring Systems using AI
+#
+#   File: dm_landmarks.py
+#
+#   Landmark extraction: MediaPipe FaceMesh results -> (N_faces, 478, 3) float32 array,
+#   plus the declarative table of the named points used by EAR, gaze and head pose.
+#
+#**************************************************************************************
+
+import functools
+
+import numpy as np
+
+from dm_metrics import METRICS
+
+NUM_LANDMARKS = 478 # FaceMesh with refine_landmarks=True (468 mesh + 10 iris points)
+X = 0
+Y = 1
+Z = 2
+
+# Eye axis used by all the grouped arrays below
+LEFT = 0
+RIGHT = 1
+
+## Named landmarks (each index is gathered once per frame)
+#LEFT_EYE =[ 362, 382, 381, 380, 374, 373, 390, 249, 263, 466, 388, 387, 386, 385,384, 398 ]
+#RIGHT_EYE=[ 33, 7, 163, 144, 145, 153, 154, 155, 133, 173, 157, 158, 159, 160, 161 , 246 ]
+#LEFT_IRIS = [473, 474, 475, 476, 477]
+#RIGHT_IRIS = [468, 469, 470, 471, 472]
+LANDMARK_TABLE = (
+    # name      index
+    ("NOSE",    1),   # Nose tip
+    ("RER",     33),  # Right Eye Right
+    ("REB",     145), # Right Eye Bottom
+    ("REL",     133), # Right Eye Left
+    ("RET",     159), # Right Eye Top
+    ("LER",     362), # Left Eye Right
+    ("LEB",     374), # Left Eye Bottom
+    ("LEL",     263), # Left Eye Left
+    ("LET",     386), # Left Eye Top
+    ("REIC",    468), # Right Eye Iris Center
+    ("LEIC",    473), # Left Eye Iris Center
+    ("P2_left", 385),
+    ("P3_left", 387),
+    ("P5_left", 373),
+    ("P6_left", 380),
+    ("P2_right", 160),
+    ("P3_right", 158),
+    ("P5_right", 153),
+    ("P6_right", 144),
+    ("MOUTH_R", 61),  # Mouth corner (PnP)
+    ("MOUTH_L", 291), # Mouth corner (PnP)
+    ("CHIN",    199), # Chin (PnP)
+)
+
+NAMES = tuple(name for name, _ in LANDMARK_TABLE)
+INDICES = np.array([idx for _, idx in LANDMARK_TABLE], dtype=np.intp)
+SLOT = {name: slot for slot, name in enumerate(NAMES)}
+
+
+def _slots(*names):
+    return np.array([SLOT[name] for name in names], dtype=np.intp)
+
+
+## Groups, expressed as slots into the gathered (..., len(INDICES), 3) array
+# EAR points P1..P6 (P1/P4 are the eye corners)
+EAR_SLOTS = np.stack([
+    _slots("LER", "P2_left", "P3_left", "LEL", "P5_left", "P6_left"),
+    _slots("RER", "P2_right", "P3_right", "REL", "P5_right", "P6_right"),
+])
+# Eye box: (right corner, bottom, left corner, top) in image coordinates
+EYE_BOX_SLOTS = np.stack([
+    _slots("LER", "LEB", "LEL", "LET"),
+    _slots("RER", "REB", "REL", "RET"),
+])
+IRIS_SLOTS = _slots("LEIC", "REIC")
+# Points fed to solvePnP, in ascending landmark index order as in the original loop
+PNP_SLOTS = _slots(*sorted(("NOSE", "RER", "MOUTH_R", "CHIN", "LEL", "MOUTH_L"),
+                           key=lambda name: INDICES[SLOT[name]]))
+# Points highlighted on the frame
+DRAW_SLOTS = np.concatenate([EYE_BOX_SLOTS[RIGHT], EYE_BOX_SLOTS[LEFT]])
+
+
+def landmarks_to_array(multi_face_landmarks, out=None):
+    """Convert results.multi_face_landmarks into a (N_faces, 478, 3) float32 array
+    of normalized (x, y, z) coordinates. An empty (0, 478, 3) array means no face.
+    With out, a buffer with room for the faces, the result is a view of it."""
+    if not multi_face_landmarks:
+        return np.empty((0, NUM_LANDMARKS, 3), dtype=np.float32) if out is None else out[:0]
+
+    n_faces = len(multi_face_landmarks)
+    if out is None or out.shape[0] < n_faces:
+        out = np.empty((n_faces, NUM_LANDMARKS, 3), dtype=np.float32)
+    else:
+        out = out[:n_faces]
+
+    # Written in place through a flat float32 view: no temporary array, tuple or list
+    for face, face_landmarks in enumerate(multi_face_landmarks):
+        flat = memoryview(out[face]).cast("B").cast("f")
+        for i, lm in zip(range(0, NUM_LANDMARKS * 3, 3), face_landmarks.landmark):
+            flat[i] = lm.x
+            flat[i + 1] = lm.y
+            flat[i + 2] = lm.z
+    return out
+
+
+def detect_landmarks(face_mesh, image, timestamp=None, out=None):
+    """Run FaceMesh on the image and return its (N_faces, 478, 3) landmark array.
+
+    face_mesh is a MediaPipe FaceMesh, or a stage wrapping one (dm_roi.FaceROI,
+    dm_scheduler.FrameScheduler) that exposes landmarks(image, timestamp, out) and
+    returns the array itself. timestamp [s] is the capture time of the image; out is
+    an optional (max_faces, 478, 3) float32 buffer the result is written into."""
+    landmarks = getattr(face_mesh, "landmarks", None)
+    if landmarks is not None:
+        return landmarks(image, timestamp, out)
+
+    # To improve performace
+    start = METRICS.start()
+    image.flags.writeable = False
+    results = face_mesh.process(image)
+    image.flags.writeable = True
+    METRICS.stop("inference", start)
+
+    start = METRICS.start()
+    landmarks = landmarks_to_array(results.multi_face_landmarks, out)
+    METRICS.stop("landmarks", start)
+    return landmarks
+
+
+def gather_points(landmarks, img_w, img_h):
+    """Gather every named point in one fancy-indexed read and scale x/y to pixels.
+
+    landmarks: (..., 478, 3) normalized coordinates (any leading dims: faces, frames)
+    returns:   (..., len(INDICES), 3) float64, x/y in pixels and z left untouched
+    """
+    # The cast to float64 and the scaling are one multiply into the result
+    return np.multiply(landmarks[..., INDICES, :], _pixel_scale(img_w, img_h))
+
+
+@functools.lru_cache(maxsize=8)
+def _pixel_scale(img_w, img_h):
+    return np.array([img_w, img_h, 1], dtype=np.float64)
+
+
+def eye_aspect_ratio(points):
+    """EAR for both eyes, (..., 2) indexed by LEFT/RIGHT.
+
+    As in the original per-landmark code, EAR points are truncated to integer pixels."""
+    p = np.trunc(points[..., EAR_SLOTS, :2]) # (..., 2, 6, 2)
+    vertical = np.abs(p[..., 1, Y] - p[..., 5, Y]) + np.abs(p[..., 2, Y] - p[..., 4, Y])
+    horizontal = 2 * np.abs(p[..., 0, X] - p[..., 3, X])
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return vertical / horizontal
+
+
+def eye_boxes(points):
+    """Eye centers (..., 2, 2) and sizes (..., 2, 2) as (width, height) for both eyes."""
+    box = points[..., EYE_BOX_SLOTS, :2] # (..., 2, 4, 2)
+    size = np.stack([box[..., 2, X] - box[..., 0, X], box[..., 1, Y] - box[..., 3, Y]], axis=-1)
+    center = np.stack([(box[..., 2, X] + box[..., 0, X]) / 2, (box[..., 1, Y] + box[..., 3, Y]) / 2], axis=-1)
+    return center, size
+
+
+def eye_gaze_2d(points):
+    """2D gaze for both eyes, (..., 2, 2): iris offset from the eye center, normalized by
+    half the eye width/height. Components are in the [-1;1] range."""
+    center, size = eye_boxes(points)
+    iris = points[..., IRIS_SLOTS, :2]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return (iris - center) / (size / 2)
+
+
+def head_roll(points):
+    """Roll in degrees from the outer eye corners, wrapped into (-180;180]."""
+    rer = points[..., SLOT["RER"], :]
+    lel = points[..., SLOT["LEL"], :]
+    roll = 180 + np.degrees(np.arctan2(rer[..., Y] - lel[..., Y], rer[..., X] - lel[..., X]))
+    return np.where(roll > 180, roll - 360, roll)
+
+
+def pnp_points(points, out=None):
+    """solvePnP inputs: face_2d (..., 6, 2) and face_3d (..., 6, 3), float64.
+
+    x/y are truncated to integer pixels and z is the raw normalized depth, as before.
+    out is an optional (face_2d, face_3d) pair of buffers to fill instead."""
+    if out is None:
+        face_3d = np.ascontiguousarray(points[..., PNP_SLOTS, :]) # solvePnP takes a frame of it as is
+        face_2d = None
+    else:
+        face_2d, face_3d = out
+        np.take(points, PNP_SLOTS, axis=-2, out=face_3d, mode="clip") # "raise" buffers out
+    np.trunc(face_3d[..., :2], out=face_3d[..., :2])
+    if face_2d is None:
+        face_2d = np.ascontiguousarray(face_3d[..., :2])
+    else:
+        face_2d[...] = face_3d[..., :2]
+    return face_2d, face_3d
@@ -0,0 +1,174 @@
+#**************************************************************************************
+#
+#   Driver Monitoring Systems using AI
+#
+#   File: dm_metrics.py
+#
+#   Per-stage latency instrumentation: rolling p50/p95/p99 per stage, exposed as
+#   Prometheus text on a local HTTP endpoint and as a periodic JSON dump.
+#   Disabled by default, then a timed stage costs two no-op method calls.
+#
+#**************************************************************************************
+
+import json
+import os
+import threading
+import time
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+
+## Stages timed in the hot path
+STAGES = (
+    "capture",    # cap.read()
+    "inference",  # face_mesh.process()
+    "landmarks",  # results -> (N_faces, 478, 3) array
+    "signals",    # gather, EAR, gaze, roll
+    "pose",       # solvePnP and angles
+    "rules",      # calibration, drowsiness window, distraction debounce
+    "draw",       # overlay
+    "display",    # cv2.imshow and cv2.waitKey
+    "publish",    # frame and overlay description into the shared-memory frame bus
+    "latency",    # capture to display (frame age when shown)
+)
+ROLLING_SAMPLES = 1024 # Samples kept per stage for the percentiles
+QUANTILES = (0.5, 0.95, 0.99)
+METRICS_HOST = "127.0.0.1"
+
+
+class StageMetrics:
+    """Rolling latency samples per stage. Time a stage with:
+
+        start = METRICS.start()
+        ...
+        METRICS.stop("pose", start)
+
+    While disabled, start() returns 0 and stop() returns at once."""
+
+    def __init__(self, size=ROLLING_SAMPLES):
+        self.enabled = False
+        self.size = size
+        self._samples = {}
+        self._index = {}
+        self._count = {}
+        self._sum = {}
+        self._lock = threading.Lock()
+
+    def enable(self, size=None):
+        if size is not None:
+            self.size = size
+        self.reset()
+        self.enabled = True
+
+    def disable(self):
+        self.enabled = False
+
+    def reset(self):
+        with self._lock:
+            self._samples = {stage: [0.0] * self.size for stage in STAGES}
+            self._index = dict.fromkeys(STAGES, 0)
+            self._count = dict.fromkeys(STAGES, 0)
+            self._sum = dict.fromkeys(STAGES, 0.0)
+
+    def start(self):
+        return time.perf_counter() if self.enabled else 0
+
+    def stop(self, stage, start):
+        if self.enabled:
+            self.record(stage, time.perf_counter() - start)
+
+    def record(self, stage, seconds):
+        if not self.enabled:
+            return
+        if stage not in self._samples:
+            with self._lock:
+                self._samples.setdefault(stage, [0.0] * self.size)
+                self._index.setdefault(stage, 0)
+                self._count.setdefault(stage, 0)
+                self._sum.setdefault(stage, 0.0)
+        index = self._index[stage]
+        self._samples[stage][index] = seconds
+        self._index[stage] = (index + 1) % self.size
+        self._count[stage] += 1
+        self._sum[stage] += seconds
+
+    def snapshot(self):
+        """{stage: {count, sum, mean, max, p50, p95, p99}} of the stages seen so far [s]."""
+        with self._lock:
+            stages = list(self._samples)
+        snapshot = {}
+        for stage in stages:
+            count = self._count[stage]
+            if not count:
+                continue
+            samples = np.array(self._samples[stage][:min(count, self.size)])
+            quantiles = np.quantile(samples, QUANTILES)
+            snapshot[stage] = {
+                "count": count,
+                "sum": self._sum[stage],
+                "mean": float(samples.mean()),
+                "max": float(samples.max()),
+                **{f"p{round(q * 100)}": float(v) for q, v in zip(QUANTILES, quantiles)},
+            }
+        return snapshot
+
+    def prometheus_text(self):
+        lines = ["# HELP dm_stage_seconds Latency of each stage of the driver monitor (rolling window).",
+                 "# TYPE dm_stage_seconds summary"]
+        for stage, stats in self.snapshot().items():
+            for q in QUANTILES:
+                lines.append(f'dm_stage_seconds{{stage="{stage}",quantile="{q}"}} {stats[f"p{round(q * 100)}"]:.9f}')
+            lines.append(f'dm_stage_seconds_sum{{stage="{stage}"}} {stats["sum"]:.9f}')
+            lines.append(f'dm_stage_seconds_count{{stage="{stage}"}} {stats["count"]}')
+        return "\n".join(lines) + "\n"
+
+    def dump_json(self, path):
+        tmp = path + ".tmp"
+        with open(tmp, "w") as out:
+            json.dump({"time": time.time(), "stages": self.snapshot()}, out, indent=1)
+        os.replace(tmp, path)
+
+
+# The process-wide instance used by the instrumented code
+METRICS = StageMetrics()
+
+
+def serve(port, host=METRICS_HOST, metrics=METRICS):
+    """Serve /metrics (Prometheus text) and /metrics.json on a daemon thread."""
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path == "/metrics":
+                body, content_type = metrics.prometheus_text(), "text/plain; version=0.0.4"
+            elif self.path == "/metrics.json":
+                body, content_type = json.dumps(metrics.snapshot()), "application/json"
+            else:
+                self.send_error(404)
+                return
+            body = body.encode()
+            self.send_response(200)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    threading.Thread(target=server.serve_forever, name="metrics-http", daemon=True).start()
+    return server
+
+
+def dump_periodically(path, interval=10.0, metrics=METRICS):
+    """Write the JSON snapshot to path every interval seconds, on a daemon thread.
+    Returns an Event that stops it."""
+    stop = threading.Event()
+
+    def run():
+        while not stop.wait(interval):
+            metrics.dump_json(path)
+
+    threading.Thread(target=run, name="metrics-dump", daemon=True).start()
+    return stop
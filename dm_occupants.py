@@ -0,0 +1,172 @@
+#**************************************************************************************
+#
+#   Driver Monitoring Systems using AI
+#
+#   File: dm_occupants.py
+#
+#   Several occupants at once: faces get stable IDs across frames (landmark box IoU,
+#   then centroid distance), each ID has its own calibration, drowsiness window and
+#   distraction debounce, and the signals of all the faces are computed together.
+#
+#**************************************************************************************
+
+import numpy as np
+
+from collections import deque
+
+from dm_detector import CLOSED_VAL, OPEN_VAL, DriverMonitor
+from dm_landmarks import eye_aspect_ratio, eye_gaze_2d, gather_points, head_roll
+from dm_metrics import METRICS
+from dm_pose import estimate_poses
+from dm_window import MIN_EAR, TEMPORAL_WINDOW_SECONDS
+
+IOU_THRESHOLD = 0.3       # Minimum box overlap to keep the ID of a face
+CENTROID_THRESHOLD = 0.5  # Maximum centroid move, in face sizes, when boxes don't overlap enough
+TRACK_TIMEOUT = 2.0       # [s] an ID is forgotten (with its state) after this long unseen
+DROPPED_BACKLOG = 64      # Dropped IDs kept until a consumer pops them
+
+
+def face_boxes(landmarks):
+    """(N_faces, 4) boxes (x0, y0, x1, y1) around the landmarks, normalized coordinates."""
+    xy = landmarks[..., :2]
+    return np.concatenate([xy.min(axis=-2), xy.max(axis=-2)], axis=-1)
+
+
+def box_iou(a, b):
+    """(len(a), len(b)) intersection over union of two arrays of boxes."""
+    x0 = np.maximum(a[:, None, 0], b[None, :, 0])
+    y0 = np.maximum(a[:, None, 1], b[None, :, 1])
+    x1 = np.minimum(a[:, None, 2], b[None, :, 2])
+    y1 = np.minimum(a[:, None, 3], b[None, :, 3])
+    inter = np.clip(x1 - x0, 0, None) * np.clip(y1 - y0, 0, None)
+    area_a = (a[:, 2] - a[:, 0]) * (a[:, 3] - a[:, 1])
+    area_b = (b[:, 2] - b[:, 0]) * (b[:, 3] - b[:, 1])
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return np.nan_to_num(inter / (area_a[:, None] + area_b[None, :] - inter))
+
+
+class FaceTracker:
+    """Stable IDs for the faces of consecutive frames.
+
+    Faces are matched to the known tracks greedily, best box IoU first; faces left
+    over are matched on centroid distance (relative to the face size), then get new
+    IDs. A track unseen for longer than timeout seconds is dropped."""
+
+    def __init__(self, iou_threshold=IOU_THRESHOLD, centroid_threshold=CENTROID_THRESHOLD, timeout=TRACK_TIMEOUT):
+        self.iou_threshold = iou_threshold
+        self.centroid_threshold = centroid_threshold
+        self.timeout = timeout
+        self.ids = []                     # track IDs, in the order of the rows below
+        self.boxes = np.empty((0, 4))
+        self.unseen = np.empty(0)         # [s] since each track was last matched
+        self.next_id = 0
+
+    def update(self, landmarks, dt):
+        """IDs of the (N_faces, 478, 3) faces, and the list of IDs dropped."""
+        boxes = face_boxes(landmarks) if len(landmarks) else np.empty((0, 4))
+        ids = [None] * len(boxes)
+        matched = np.zeros(len(self.ids), dtype=bool)
+
+        if len(boxes) and len(self.ids):
+            iou = box_iou(boxes, self.boxes)
+            for face, track in zip(*np.unravel_index(np.argsort(-iou, axis=None), iou.shape)):
+                if iou[face, track] < self.iou_threshold:
+                    break
+                if ids[face] is None and not matched[track]:
+                    ids[face], matched[track] = self.ids[track], True
+
+            centers = (boxes[:, :2] + boxes[:, 2:]) / 2
+            tracked = (self.boxes[:, :2] + self.boxes[:, 2:]) / 2
+            size = np.maximum(self.boxes[:, 2] - self.boxes[:, 0], self.boxes[:, 3] - self.boxes[:, 1])
+            distance = np.linalg.norm(centers[:, None] - tracked[None], axis=-1) / np.maximum(size, 1e-6)
+            for face, track in zip(*np.unravel_index(np.argsort(distance, axis=None), distance.shape)):
+                if distance[face, track] > self.centroid_threshold:
+                    break
+                if ids[face] is None and not matched[track]:
+                    ids[face], matched[track] = self.ids[track], True
+
+        # Tracks not seen in this frame age, and are dropped after the timeout
+        unseen = np.where(matched, 0.0, self.unseen + dt)
+        keep = unseen <= self.timeout
+        dropped = [track_id for track_id, kept in zip(self.ids, keep) if not kept]
+        track_ids = [track_id for track_id, kept in zip(self.ids, keep) if kept]
+        track_boxes = self.boxes[keep]
+        unseen = unseen[keep]
+
+        for face, face_id in enumerate(ids):
+            if face_id is None:
+                ids[face] = self.next_id
+                self.next_id += 1
+                track_ids.append(ids[face])
+                track_boxes = np.vstack([track_boxes, boxes[face]])
+                unseen = np.append(unseen, 0.0)
+        rows = {track_id: row for row, track_id in enumerate(track_ids)}
+        for face, face_id in enumerate(ids):
+            track_boxes[rows[face_id]] = boxes[face]
+
+        self.ids, self.boxes, self.unseen = track_ids, track_boxes, unseen
+        return ids, dropped
+
+    def reset(self):
+        self.ids = []
+        self.boxes = np.empty((0, 4))
+        self.unseen = np.empty(0)
+
+
+class OccupantMonitor:
+    """Detection for every face in the frame, with a DriverMonitor (calibration,
+    drowsiness window, distraction debounce, pose warm start) per tracked ID.
+
+    EAR, normalized opening, gaze and roll are computed for all the faces in one
+    array operation, and the pose angles of all the faces together (solvePnP still
+    runs once per face). process() returns {ID: Signals}, or None without faces.
+    The IDs of the dropped tracks are appended to the dropped deque, for a consumer on
+    another thread (dm_events.AlertTracker) to pop."""
+
+    def __init__(self, drowsiness_mode=MIN_EAR, windows=(TEMPORAL_WINDOW_SECONDS,), tracker=None):
+        self.drowsiness_mode = drowsiness_mode
+        self.windows = windows
+        self.tracker = FaceTracker() if tracker is None else tracker
+        self.monitors = {}
+        self.dropped = deque(maxlen=DROPPED_BACKLOG)
+
+    def recalibrate(self):
+        for monitor in self.monitors.values():
+            monitor.recalibrate()
+
+    def process(self, landmarks, img_w, img_h, dt):
+        ids, dropped = self.tracker.update(landmarks, dt)
+        for face_id in dropped:
+            del self.monitors[face_id]
+        self.dropped.extend(dropped)
+        for face_id, monitor in self.monitors.items():
+            if face_id not in ids:
+                monitor.pose.reset() # unseen: state kept, next solve starts cold
+        if not ids:
+            return None
+
+        monitors = []
+        for face_id in ids:
+            if face_id not in self.monitors:
+                self.monitors[face_id] = DriverMonitor(self.drowsiness_mode, self.windows)
+            monitors.append(self.monitors[face_id])
+
+        start = METRICS.start()
+        points = gather_points(landmarks, img_w, img_h) # (N_faces, len(INDICES), 3)
+        ear = eye_aspect_ratio(points)                  # (N_faces, 2)
+        eye_open = (ear - CLOSED_VAL) / (OPEN_VAL - CLOSED_VAL)
+        roll = head_roll(points)                        # (N_faces,)
+        gaze = eye_gaze_2d(points)                      # (N_faces, 2, 2)
+        METRICS.stop("signals", start)
+
+        start = METRICS.start()
+        pitch, yaw = estimate_poses([monitor.pose for monitor in monitors], points, img_w, img_h)
+        METRICS.stop("pose", start)
+
+        start = METRICS.start()
+        occupants = {}
+        for face, (face_id, monitor) in enumerate(zip(ids, monitors)):
+            occupants[face_id] = monitor.rules(points[face:face + 1], ear[face], eye_open[face], gaze[face],
+                                               pitch[face], yaw[face], roll[face], dt)
+        METRICS.stop("rules", start)
+        return occupants
@@ -0,0 +1,306 @@
+#**************************************************************************************
+#
+#   Driver Monitoring Systems using AI
+#
+#   File: dm_offline.py
+#
+#   Headless batch mode: run the detector on a recorded video as fast as possible,
+#   with the container timestamps as timebase, and save the per-frame signals.
+#
+#   Usage: python dm_offline.py video.mp4 -o signals.npz [--no-cache] [--jobs N]
+#
+#**************************************************************************************
+
+import argparse
+import math
+import multiprocessing as mproc
+import os
+import shutil
+import tempfile
+import time
+
+import cv2
+import numpy as np
+
+from dm_cache import DEFAULT_CACHE_DIR, DEFAULT_MAX_BYTES, CacheEntry, LandmarkCache, LandmarkWriter, LANDMARKS
+from dm_detector import FACE_MESH_SETTINGS, DriverMonitor, create_face_mesh
+from dm_landmarks import detect_landmarks, gather_points
+from dm_pose import HeadPoseEstimator
+from dm_pipeline import Pipeline, BLOCK, open_capture, video_timebase
+from dm_window import DROWSINESS_MODES, MIN_EAR
+
+CHUNK_OVERLAP = 30 # Frames FaceMesh tracks before a chunk starts, so it doesn't start the chunk cold
+
+## Per-frame signals written to the output file
+SIGNAL_FIELDS = (
+    # name             dtype       shape
+    ("frame",          np.int32,   ()),
+    ("timestamp",      np.float64, ()),     # [s] container timestamp
+    ("face",           np.bool_,   ()),     # a face was found (the other fields are NaN/False otherwise)
+    ("ear",            np.float32, (2,)),   # LEFT, RIGHT
+    ("eye_open",       np.float32, (2,)),   # normalized EAR, LEFT, RIGHT
+    ("gaze",           np.float32, (2, 2)), # LEFT/RIGHT, X/Y
+    ("pitch",          np.float32, ()),
+    ("yaw",            np.float32, ()),
+    ("roll",           np.float32, ()),
+    ("calibrating",    np.bool_,   ()),
+    ("closed_time",    np.float32, ()),
+    ("perclos",        np.float32, ()),
+    ("drowsy",         np.bool_,   ()),
+    ("distracted_time", np.float32, ()),
+    ("distracted",     np.bool_,   ()),
+)
+
+
+class SignalRecorder:
+    """Accumulates one row of SIGNAL_FIELDS per frame."""
+
+    def __init__(self):
+        self._columns = {name: [] for name, _, _ in SIGNAL_FIELDS}
+
+    def __len__(self):
+        return len(self._columns["frame"])
+
+    def add(self, index, timestamp, signals):
+        columns = self._columns
+        columns["frame"].append(index)
+        columns["timestamp"].append(timestamp)
+        columns["face"].append(signals is not None)
+        for name, dtype, shape in SIGNAL_FIELDS[3:]:
+            if signals is not None:
+                value = getattr(signals, name)
+            elif dtype is np.bool_:
+                value = False
+            else:
+                value = np.full(shape, np.nan)
+            columns[name].append(value)
+
+    def arrays(self):
+        return {name: np.array(self._columns[name], dtype=dtype).reshape((len(self),) + shape)
+                for name, dtype, shape in SIGNAL_FIELDS}
+
+
+def save_signals(path, signals):
+    np.savez_compressed(path, **signals)
+
+
+def load_signals(path):
+    with np.load(path) as data:
+        return {name: data[name] for name in data.files}
+
+
+def replay(entry, monitor, recorder):
+    """Run the detection on the landmarks of a cache entry, without decoding the video.
+    Head pose is solved for all the frames with a face in one batch beforehand."""
+    timestamps = entry.timestamps
+    with_face = np.flatnonzero(entry.faces)
+    poses = {}
+    if len(with_face):
+        # The last detected face drives the detection
+        last_face = entry.landmarks[with_face, entry.faces[with_face].astype(np.intp) - 1]
+        points = gather_points(last_face, entry.img_w, entry.img_h)
+        # As in the sequential run, a solve after a frame without a face starts cold
+        cold = np.diff(with_face, prepend=-1) != 1
+        pitch, yaw = HeadPoseEstimator().estimate_batch(points, entry.img_w, entry.img_h, cold)
+        poses = dict(zip(with_face.tolist(), zip(pitch.tolist(), yaw.tolist())))
+
+    previous = None
+    for index in range(len(entry)):
+        timestamp = float(timestamps[index])
+        dt = 0 if previous is None else timestamp - previous
+        previous = timestamp
+        signals = monitor.process(entry.frame(index), entry.img_w, entry.img_h, dt, pose=poses.get(index))
+        recorder.add(index, timestamp, signals)
+
+
+def extract_chunk(path, settings, staging, start, stop=None, overlap=CHUNK_OVERLAP):
+    """Worker of extract_landmarks(): the landmarks of frames [start, stop) of a video
+    (stop=None: to the end) streamed to a LandmarkWriter in staging.
+
+    The capture seeks to `overlap` frames (at least one) before start: FaceMesh tracks
+    them to pick the face up as the sequential run would have, and the timestamp of
+    the frame before start lets the caller check that the seek was frame accurate."""
+    first = max(start - max(overlap, 1), 0)
+    face_mesh = create_face_mesh(**settings)
+    cap = open_capture(path)
+    if first:
+        cap.set(cv2.CAP_PROP_POS_FRAMES, first)
+    writer = LandmarkWriter(staging, settings["max_num_faces"])
+    before = None # timestamp of frame start - 1
+    index = first
+    try:
+        while stop is None or index < stop:
+            success, image = cap.read()
+            if not success:
+                break
+            timestamp = video_timebase(cap)
+            landmarks = detect_landmarks(face_mesh, image, timestamp)
+            if index >= start:
+                img_h, img_w = image.shape[:2]
+                writer.add(timestamp, landmarks, img_w, img_h)
+            elif index == start - 1:
+                before = timestamp
+            index += 1
+    finally:
+        writer.close()
+        cap.release()
+        face_mesh.close()
+    return {"start": start, "before": before, "faces": writer.faces, "timestamps": writer.timestamps,
+            "img_w": writer.img_w, "img_h": writer.img_h}
+
+
+def _extract_chunk(args):
+    return extract_chunk(*args)
+
+
+def extract_landmarks(path, writer, settings, jobs=None, chunk_frames=None, overlap=CHUNK_OVERLAP):
+    """Run FaceMesh on a whole video with a pool of `jobs` processes (default: one per
+    core), each seeking to its own range of chunk_frames frames (default: an equal
+    share per process), and stitch the landmarks in frame order into writer.
+
+    Raises IOError when the container can't be seeked frame accurately (the chunks
+    don't join up); process the video with jobs=1 then."""
+    cap = open_capture(path)
+    if not cap.isOpened():
+        raise IOError(f"cannot open video {path!r}")
+    frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+    cap.release()
+
+    jobs = jobs or os.cpu_count() or 1
+    chunk_frames = chunk_frames or max(math.ceil(frames / jobs), 1)
+    starts = list(range(0, max(frames, 1), chunk_frames))
+    staging = tempfile.mkdtemp(prefix=".chunks-", dir=os.path.dirname(writer.staging))
+    chunks = [(path, settings, os.path.join(staging, str(number)), start,
+               None if number == len(starts) - 1 else start + chunk_frames, overlap) # the frame count may be short
+              for number, start in enumerate(starts)]
+    for chunk in chunks:
+        os.mkdir(chunk[2])
+
+    try:
+        with mproc.Pool(min(jobs, len(chunks))) as pool:
+            # In frame order, each chunk as soon as it and the ones before it are done
+            for (_, _, directory, _, _, _), chunk in zip(chunks, pool.imap(_extract_chunk, chunks)):
+                if not chunk["timestamps"]:
+                    continue # past the end: the frame count was too large
+                complete = len(writer.timestamps) == chunk["start"]
+                if not complete or (chunk["start"] and chunk["before"] != writer.timestamps[-1]):
+                    raise IOError(f"{path!r} can't be seeked frame accurately, process it with one job")
+                writer.append(os.path.join(directory, LANDMARKS), chunk["faces"], chunk["timestamps"],
+                              chunk["img_w"], chunk["img_h"])
+                shutil.rmtree(directory, ignore_errors=True)
+    finally:
+        shutil.rmtree(staging, ignore_errors=True)
+    return writer
+
+
+def process_video(path, output=None, face_mesh=None, drowsiness_mode=MIN_EAR, queue_size=4,
+                  cache=None, settings=None, jobs=1, chunk_frames=None, overlap=CHUNK_OVERLAP):
+    """Run the detection on every frame of a video file, without drawing or display.
+
+    The drowsiness window and the distraction debounce advance with the container
+    timestamps (CAP_PROP_POS_MSEC), so results don't depend on the host speed.
+    Decoding and inference overlap on two threads; no frame is dropped.
+
+    With a LandmarkCache, the landmarks of a video already seen with the same FaceMesh
+    settings are replayed from disk and MediaPipe isn't run at all; otherwise they are
+    stored while processing. settings (default FACE_MESH_SETTINGS) must be the ones
+    face_mesh was built with.
+
+    With jobs > 1 (None: one per core), FaceMesh runs on chunks of chunk_frames frames
+    in a process pool (see extract_landmarks(); face_mesh is not used) and the
+    detection then replays the stitched landmarks in frame order, as from the cache.
+    The calibration, drowsiness window and distraction debounce thus see every frame
+    in sequence and the signals are those of a sequential run on the same landmarks.
+    Returns the SIGNAL_FIELDS arrays and saves them to output (.npz) if given."""
+    if settings is None:
+        settings = FACE_MESH_SETTINGS
+    monitor = DriverMonitor(drowsiness_mode=drowsiness_mode)
+    recorder = SignalRecorder()
+
+    entry = cache.get(path, settings) if cache is not None else None
+    if entry is not None:
+        replay(entry, monitor, recorder)
+    elif jobs != 1:
+        if cache is not None:
+            writer = cache.writer(settings["max_num_faces"])
+        else:
+            writer = LandmarkWriter(tempfile.mkdtemp(prefix="dm-landmarks-"), settings["max_num_faces"])
+        try:
+            extract_landmarks(path, writer, settings, jobs, chunk_frames, overlap)
+            if cache is not None:
+                entry = cache.put(path, settings, writer)
+            else:
+                entry = CacheEntry(writer.staging, writer.finish(settings))
+            replay(entry, monitor, recorder)
+        except BaseException:
+            writer.abort()
+            raise
+        finally:
+            if cache is None:
+                shutil.rmtree(writer.staging, ignore_errors=True)
+    else:
+        if face_mesh is None:
+            face_mesh = create_face_mesh(**settings)
+        cap = open_capture(path)
+        if not cap.isOpened():
+            raise IOError(f"cannot open video {path!r}")
+
+        writer = cache.writer(settings["max_num_faces"]) if cache is not None else None
+        pipeline = Pipeline(cap, face_mesh, monitor, queue_size=queue_size, overflow=BLOCK,
+                            timebase=video_timebase).start()
+        try:
+            for frame in pipeline.frames():
+                recorder.add(frame.index, frame.timestamp, frame.signals)
+                if writer is not None:
+                    img_h, img_w = frame.image.shape[:2]
+                    writer.add(frame.timestamp, frame.landmarks, img_w, img_h)
+        except BaseException:
+            if writer is not None:
+                writer.abort()
+            raise
+        finally:
+            pipeline.stop()
+            cap.release()
+        if writer is not None:
+            cache.put(path, settings, writer)
+
+    signals = recorder.arrays()
+    if output is not None:
+        save_signals(output, signals)
+    return signals
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Headless driver monitoring of a recorded video")
+    parser.add_argument("video", help="video file")
+    parser.add_argument("-o", "--output", default=None, help="output file (default: <video>.signals.npz)")
+    parser.add_argument("--drowsiness-mode", choices=DROWSINESS_MODES, default=MIN_EAR,
+                        help="drowsiness rule (default: %(default)s)")
+    parser.add_argument("--no-cache", action="store_true", help="always run MediaPipe, don't use the landmark cache")
+    parser.add_argument("--cache-dir", default=DEFAULT_CACHE_DIR, help="landmark cache directory (default: %(default)s)")
+    parser.add_argument("--cache-max-gb", type=float, default=DEFAULT_MAX_BYTES / 1024 ** 3,
+                        help="landmark cache size cap, least recently used videos are evicted (default: %(default)s)")
+    parser.add_argument("--jobs", type=int, default=1, metavar="N",
+                        help="run FaceMesh on chunks of the video in N processes (0: one per core, default: 1)")
+    parser.add_argument("--chunk-frames", type=int, default=None,
+                        help="frames per chunk with --jobs (default: an equal share per process)")
+    parser.add_argument("--overlap", type=int, default=CHUNK_OVERLAP,
+                        help="frames FaceMesh tracks before each chunk (default: %(default)s)")
+    args = parser.parse_args()
+
+    output = args.output or args.video + ".signals.npz"
+    cache = None if args.no_cache else LandmarkCache(args.cache_dir, int(args.cache_max_gb * 1024 ** 3))
+    start = time.monotonic()
+    signals = process_video(args.video, output, drowsiness_mode=args.drowsiness_mode, cache=cache,
+                            jobs=args.jobs or None, chunk_frames=args.chunk_frames, overlap=args.overlap)
+    elapsed = time.monotonic() - start
+
+    frames = len(signals["frame"])
+    duration = signals["timestamp"][-1] if frames else 0.0
+    print(f"{frames} frames ({duration:.1f} s of video) in {elapsed:.1f} s "
+          f"({frames / elapsed if elapsed > 0 else 0:.1f} fps), "
+          f"drowsy {int(signals['drowsy'].sum())} frames, distracted {int(signals['distracted'].sum())} frames -> {output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,116 @@
+#**************************************************************************************
+#
+#   Driver Monitoring Systems using AI
+#
+#   File: dm_overlay.py
+#
+#   Drawing of the detection results on the frame shown to the user. The results are
+#   first reduced to a compact overlay description (a fixed-size numpy record: points,
+#   lines, alert flags), which can be rendered here or in another process.
+#
+#**************************************************************************************
+
+import cv2
+import numpy as np
+
+from dm_landmarks import LEFT, RIGHT, SLOT, DRAW_SLOTS, IRIS_SLOTS, X, Y, eye_boxes
+
+FONT_SCALE = 1.5 * 1e-3  # Adjust for larger font size in all images
+MAX_FACES = 8            # Faces an overlay description can hold
+DRIVER = -1              # face_ids entry of the single-driver overlay (no ID label)
+
+OVERLAY_DTYPE = np.dtype([
+    ("n_faces", np.uint8),
+    ("face_ids", np.int32, (MAX_FACES,)),
+    ("points", np.float32, (MAX_FACES, len(DRAW_SLOTS), 2)), # eye corners/lids [px]
+    ("iris", np.float32, (MAX_FACES, 2, 2)),                 # iris centers, LEFT/RIGHT
+    ("eye_centers", np.float32, (MAX_FACES, 2, 2)),
+    ("nose_lines", np.float32, (MAX_FACES, 4)),              # head direction (x0, y0, x1, y1)
+    ("calibrating", np.bool_, (MAX_FACES,)),
+    ("drowsy", np.bool_, (MAX_FACES,)),
+    ("distracted", np.bool_, (MAX_FACES,)),
+    ("fps", np.float32),
+    ("latency", np.float32),                                 # [s], NaN when unknown
+])
+
+
+def describe_overlay(record, signals, img_w, img_h, fps=None, latency=None):
+    """Fill an OVERLAY_DTYPE record from a Signals record (the driver) or from the
+    {ID: Signals} of an OccupantMonitor. The face driving each Signals is described."""
+    line_scale = min(img_w, img_h) * FONT_SCALE
+    if isinstance(signals, dict):
+        faces = sorted(signals.items())[:MAX_FACES]
+    else:
+        faces = [(DRIVER, signals)]
+
+    record["n_faces"] = len(faces)
+    for face, (face_id, face_signals) in enumerate(faces):
+        face_points = face_signals.points[-1]
+        eye_center, _ = eye_boxes(face_points)
+        nose_2d = face_points[SLOT["NOSE"]]
+        record["face_ids"][face] = face_id
+        record["points"][face] = face_points[DRAW_SLOTS, :2]
+        record["iris"][face] = face_points[IRIS_SLOTS, :2]
+        record["eye_centers"][face] = eye_center
+        record["nose_lines"][face] = (nose_2d[X], nose_2d[Y], nose_2d[X] - face_signals.yaw * line_scale,
+                                      nose_2d[Y] - face_signals.pitch * line_scale)
+        record["calibrating"][face] = face_signals.calibrating
+        record["drowsy"][face] = face_signals.drowsy
+        record["distracted"][face] = face_signals.distracted
+    record["fps"] = np.nan if fps is None else fps
+    record["latency"] = np.nan if latency is None else latency
+    return record
+
+
+def render_overlay(image, record):
+    """Draw an overlay description on the image."""
+    img_h, img_w = image.shape[:2]
+    font_scale = min(img_w, img_h) * FONT_SCALE
+
+    for face in range(int(record["n_faces"])):
+        for point in record["points"][face]:
+            cv2.circle(image, (int(point[X]), int(point[Y])), radius=5, color=(0, 0, 255), thickness=-1)
+
+        iris = record["iris"][face]
+        eye_center = record["eye_centers"][face]
+        cv2.circle(image, (int(iris[LEFT][X]), int(iris[LEFT][Y])), radius=3, color=(0, 255, 0), thickness=-1) # Center of iris
+        cv2.circle(image, (int(eye_center[LEFT][X]), int(eye_center[LEFT][Y])), radius=2, color=(128, 128, 128), thickness=-1) # Center of eye
+        cv2.circle(image, (int(iris[RIGHT][X]), int(iris[RIGHT][Y])), radius=2, color=(0, 255, 0), thickness=-1) # Center of iris
+        cv2.circle(image, (int(eye_center[RIGHT][X]), int(eye_center[RIGHT][Y])), radius=2, color=(0, 0, 255), thickness=-1) # Center of eye
+
+        # Display directions
+        x0, y0, x1, y1 = record["nose_lines"][face]
+        cv2.line(image, (int(x0), int(y0)), (int(x1), int(y1)), (255, 0, 0), 3)
+
+        face_id = int(record["face_ids"][face])
+        calibrating, drowsy, distracted = (bool(record[name][face]) for name in ("calibrating", "drowsy", "distracted"))
+        if face_id == DRIVER:
+            if calibrating:
+                cv2.putText(image, "Calibrating pitch and yaw", (15, 150), cv2.FONT_HERSHEY_SIMPLEX, font_scale, (0, 255, 255), 2)
+            if drowsy:
+                cv2.putText(image, "Warning: Driver is drowsy", (15, 230), cv2.FONT_HERSHEY_SIMPLEX, font_scale, (0, 0, 255), 2)
+            if distracted:
+                cv2.putText(image, "Warning: Driver is distracted", (15, 200), cv2.FONT_HERSHEY_SIMPLEX, font_scale, (0, 0, 255), 2)
+            continue
+
+        top = record["points"][face].min(axis=0)
+        cv2.putText(image, f"#{face_id}", (int(top[X]), int(top[Y]) - 10), cv2.FONT_HERSHEY_SIMPLEX, font_scale, (255, 255, 0), 2)
+        status = ", ".join(name for name, flag in (("drowsy", drowsy), ("distracted", distracted)) if flag)
+        if status or calibrating:
+            color = (0, 0, 255) if status else (0, 255, 255)
+            cv2.putText(image, f"Occupant #{face_id}: {status or 'calibrating'}", (15, 150 + 40 * face),
+                        cv2.FONT_HERSHEY_SIMPLEX, font_scale, color, 2)
+
+    if not np.isnan(record["fps"]):
+        cv2.putText(image, f'FPS : {int(record["fps"])}', (20,450), cv2.FONT_HERSHEY_SIMPLEX, 1.5, (0, 0, 255), 2)
+    if not np.isnan(record["latency"]):
+        cv2.putText(image, f'Latency : {int(record["latency"] * 1000)} ms', (20,400), cv2.FONT_HERSHEY_SIMPLEX, font_scale, (0, 0, 255), 2)
+
+
+def draw_overlay(image, signals, fps=None, latency=None):
+    """Draw eye points, head direction and warnings of a Signals record (or of the
+    {ID: Signals} of an OccupantMonitor) on the image."""
+    img_h, img_w = image.shape[:2]
+    record = np.zeros((), dtype=OVERLAY_DTYPE)
+    describe_overlay(record, signals, img_w, img_h, fps, latency)
+    render_overlay(image, record)
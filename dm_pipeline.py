@@ -0,0 +1,222 @@
+#**************************************************************************************
+#
+#   Driver Monitoring Systems using AI
+#
+#   File: dm_pipeline.py
+#
+#   Threaded capture -> inference -> presentation pipeline. Stages are linked by
+#   bounded queues, so a slow stage never makes latency grow without bound.
+#
+#**************************************************************************************
+
+import cv2
+import threading
+import time
+
+from collections import deque
+
+from dm_landmarks import detect_landmarks
+from dm_metrics import METRICS
+
+# Overflow policies
+DROP_OLDEST = "drop-oldest" # Discard the oldest queued frame (live cameras)
+BLOCK = "block"             # Wait for the consumer (recorded video, no frame is lost)
+OVERFLOW_POLICIES = (DROP_OLDEST, BLOCK)
+
+
+def video_timebase(cap):
+    """Container timestamp [s] of the frame just read, for recorded video."""
+    return cap.get(cv2.CAP_PROP_POS_MSEC) / 1000
+
+
+def open_capture(source):
+    """Open a capture device index ("0", 0) or a video file/URL."""
+    if isinstance(source, str) and source.isdigit():
+        source = int(source)
+    return cv2.VideoCapture(source)
+
+
+class Frame:
+    """A frame travelling through the pipeline, stamped when it left the camera.
+
+    Frames recycled by a FramePool keep their image and landmark buffers."""
+    __slots__ = ("index", "image", "timestamp", "capture_time", "landmarks", "signals", "landmark_buffer")
+
+    def __init__(self, index, image, timestamp):
+        self.index = index
+        self.image = image
+        self.timestamp = timestamp # [s] time.monotonic() right after cap.read(), or the pipeline timebase
+        self.capture_time = timestamp # [s] time.monotonic() right after cap.read(), whatever the timebase
+        self.landmarks = None
+        self.signals = None
+        self.landmark_buffer = None # (max_faces, 478, 3) float32 the landmarks are a view of
+
+    def age(self, now=None):
+        """Seconds since the frame was captured."""
+        return (time.monotonic() if now is None else now) - self.capture_time
+
+
+class FramePool:
+    """Free list of Frame records: once as many frames as the pipeline holds at a time
+    have been allocated, capture reads into recycled images (cap.read(image)) and
+    landmarks are written into recycled buffers, so the steady state allocates none."""
+
+    def __init__(self):
+        self.allocated = 0
+        self._free = deque()
+
+    def acquire(self, index):
+        try:
+            frame = self._free.pop()
+        except IndexError:
+            self.allocated += 1
+            return Frame(index, None, None)
+        frame.index = index
+        frame.landmarks = None
+        frame.signals = None
+        return frame
+
+    def release(self, frame):
+        self._free.append(frame) # deque appends/pops are thread-safe
+
+
+class BoundedQueue:
+    """FIFO between two stages holding at most maxsize items.
+
+    put() on a full queue drops the oldest item (DROP_OLDEST), handing it to on_drop,
+    or waits (BLOCK). get() returns None once the queue is closed and drained."""
+
+    def __init__(self, maxsize=2, overflow=DROP_OLDEST, on_drop=None):
+        if maxsize < 1:
+            raise ValueError("maxsize must be at least 1")
+        if overflow not in OVERFLOW_POLICIES:
+            raise ValueError(f"unknown overflow policy: {overflow}")
+        self.maxsize = maxsize
+        self.overflow = overflow
+        self.on_drop = on_drop
+        self.dropped = 0        # items discarded by DROP_OLDEST
+        self.blocked_time = 0.0 # seconds producers waited on a full queue (BLOCK)
+        self.closed = False
+        self._items = deque()
+        self._cond = threading.Condition()
+
+    def __len__(self):
+        return len(self._items)
+
+    def put(self, item):
+        with self._cond:
+            if self.overflow == BLOCK:
+                if len(self._items) >= self.maxsize:
+                    start = time.monotonic()
+                    while len(self._items) >= self.maxsize and not self.closed:
+                        self._cond.wait()
+                    self.blocked_time += time.monotonic() - start
+            elif len(self._items) >= self.maxsize:
+                dropped = self._items.popleft()
+                self.dropped += 1
+                if self.on_drop is not None:
+                    self.on_drop(dropped)
+            if self.closed:
+                return False
+            self._items.append(item)
+            self._cond.notify_all()
+            return True
+
+    def get(self, timeout=None):
+        with self._cond:
+            if not self._cond.wait_for(lambda: self._items or self.closed, timeout):
+                return None
+            if not self._items:
+                return None
+            item = self._items.popleft()
+            self._cond.notify_all()
+            return item
+
+    def close(self):
+        with self._cond:
+            self.closed = True
+            self._cond.notify_all()
+
+
+class Pipeline:
+    """Runs capture and inference on their own threads; processed frames are consumed
+    by the caller (presentation must stay on the main thread for cv2.imshow).
+
+    timebase(cap) stamps each frame right after cap.read(); it defaults to the wall
+    clock, use video_timebase for recorded video.
+
+    Frames come from a FramePool: a frame yielded by frames(), with its image and
+    landmarks, is only valid until the next one is requested."""
+
+    def __init__(self, cap, face_mesh, monitor, queue_size=2, overflow=DROP_OLDEST, timebase=None):
+        self.cap = cap
+        self.timebase = timebase
+        self.face_mesh = face_mesh
+        self.monitor = monitor
+        self.pool = FramePool()
+        self.captured = BoundedQueue(queue_size, overflow, on_drop=self.pool.release)
+        self.processed = BoundedQueue(queue_size, overflow, on_drop=self.pool.release)
+        self._stop = threading.Event()
+        self._threads = [
+            threading.Thread(target=self._capture, name="capture", daemon=True),
+            threading.Thread(target=self._inference, name="inference", daemon=True),
+        ]
+
+    def start(self):
+        for thread in self._threads:
+            thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self.captured.close()
+        self.processed.close()
+        for thread in self._threads:
+            thread.join()
+
+    def frames(self):
+        """Yield processed frames until the source ends or stop() is called."""
+        frame = None
+        while True:
+            if frame is not None:
+                self.pool.release(frame) # the caller is done with it
+            frame = self.processed.get()
+            if frame is None:
+                return
+            yield frame
+
+    def _capture(self):
+        index = 0
+        while not self._stop.is_set() and self.cap.isOpened():
+            frame = self.pool.acquire(index)
+            start = METRICS.start()
+            success, image = self.cap.read(frame.image) if frame.image is not None else self.cap.read()
+            frame.capture_time = time.monotonic()
+            frame.timestamp = frame.capture_time if self.timebase is None else self.timebase(self.cap)
+            METRICS.stop("capture", start)
+            if not success or image is None:
+                break
+            frame.image = image # the same buffer, unless the frame size changed
+            self.captured.put(frame)
+            index += 1
+        self.captured.close()
+
+    def _inference(self):
+        previous = None
+        while True:
+            frame = self.captured.get()
+            if frame is None or self._stop.is_set():
+                break
+            image = frame.image
+            frame.landmarks = detect_landmarks(self.face_mesh, image, frame.timestamp, frame.landmark_buffer)
+            if frame.landmarks.base is None and len(frame.landmarks):
+                frame.landmark_buffer = frame.landmarks # freshly allocated: keep it for the next use
+
+            img_h, img_w = image.shape[:2]
+            # Frame interval from capture timestamps (dropped frames are accounted for)
+            dt = 0 if previous is None else frame.timestamp - previous
+            previous = frame.timestamp
+
+            frame.signals = self.monitor.process(frame.landmarks, img_w, img_h, dt)
+            self.processed.put(frame)
+        self.processed.close()
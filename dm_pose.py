@@ -0,0 +1,122 @@
+#**************************************************************************************
+#
+#   Driver Monitoring Systems using AI
+#
+#   File: dm_pose.py
+#
+#   Head pose: solvePnP on the PnP landmarks with cached intrinsics, warm-started from
+#   the previous frame, and Euler angles computed directly from the rotation matrix.
+#
+#**************************************************************************************
+
+import cv2
+import numpy as np
+
+from dm_landmarks import PNP_SLOTS, pnp_points
+
+ANGLE_SCALE = 1800 # pitch/yaw = Euler angles [deg] * ANGLE_SCALE, as in the original code
+
+
+def euler_angles(rmat):
+    """(x, y, z) Euler angles [deg] of rotation matrices (..., 3, 3), R = Rz @ Ry @ Rx.
+    Same angles as cv2.RQDecomp3x3 on a rotation matrix, without the decomposition."""
+    x = np.arctan2(rmat[..., 2, 1], rmat[..., 2, 2])
+    y = np.arctan2(-rmat[..., 2, 0], np.hypot(rmat[..., 2, 1], rmat[..., 2, 2]))
+    z = np.arctan2(rmat[..., 1, 0], rmat[..., 0, 0])
+    return np.degrees(np.stack([x, y, z], axis=-1))
+
+
+def rodrigues(rot_vec):
+    """Rotation matrices (..., 3, 3) of rotation vectors (..., 3), vectorized cv2.Rodrigues."""
+    theta = np.linalg.norm(rot_vec, axis=-1)[..., None, None]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        k = np.where(theta[..., 0] > 1e-12, rot_vec / theta[..., 0], 0.0)
+    K = np.zeros(rot_vec.shape[:-1] + (3, 3))
+    K[..., 0, 1], K[..., 0, 2] = -k[..., 2], k[..., 1]
+    K[..., 1, 0], K[..., 1, 2] = k[..., 2], -k[..., 0]
+    K[..., 2, 0], K[..., 2, 1] = -k[..., 1], k[..., 0]
+    return np.eye(3) + np.sin(theta) * K + (1 - np.cos(theta)) * (K @ K)
+
+
+class HeadPoseEstimator:
+    """Pitch and yaw of the head from the gathered landmark points.
+
+    The camera matrix (pinhole, focal length = image width, principal point at the
+    image center) is built once per resolution. Each solve starts from the previous
+    frame's rot_vec/trans_vec; call reset() when the face is lost.
+
+    The PnP inputs, the solution and the rotation matrix of estimate() are written
+    into buffers allocated once."""
+
+    def __init__(self):
+        self._intrinsics = {}
+        self.dist_matrix = np.zeros((4, 1), dtype=np.float64) # The distorsion parameters
+        self.rot_vec = None
+        self.trans_vec = None
+        self._rot_vec = np.zeros((3, 1), dtype=np.float64)
+        self._trans_vec = np.zeros((3, 1), dtype=np.float64)
+        self._rmat = np.empty((3, 3), dtype=np.float64)
+        self._face_2d = np.empty((len(PNP_SLOTS), 2), dtype=np.float64)
+        self._face_3d = np.empty((len(PNP_SLOTS), 3), dtype=np.float64)
+
+    def camera_matrix(self, img_w, img_h):
+        cam_matrix = self._intrinsics.get((img_w, img_h))
+        if cam_matrix is None:
+            focal_length = 1 * img_w
+            cam_matrix = np.array([[focal_length, 0, img_w / 2],
+                                   [0, focal_length, img_h / 2],
+                                   [0, 0, 1]], dtype=np.float64)
+            self._intrinsics[(img_w, img_h)] = cam_matrix
+        return cam_matrix
+
+    def reset(self):
+        self.rot_vec = None
+        self.trans_vec = None
+
+    def solve(self, face_3d, face_2d, img_w, img_h):
+        """solvePnP, warm-started when a previous solution exists; returns rot_vec."""
+        cam_matrix = self.camera_matrix(img_w, img_h)
+        # The guess (if any) and the solution share the same buffers
+        success, rot_vec, trans_vec = cv2.solvePnP(face_3d, face_2d, cam_matrix, self.dist_matrix,
+                                                   self._rot_vec, self._trans_vec,
+                                                   useExtrinsicGuess=self.rot_vec is not None)
+        if success and np.isfinite(rot_vec).all() and np.isfinite(trans_vec).all():
+            self.rot_vec, self.trans_vec = rot_vec, trans_vec
+        else:
+            self.reset()
+        return rot_vec
+
+    def estimate(self, face_points, img_w, img_h):
+        """(pitch, yaw) of one face from its gathered points."""
+        face_2d, face_3d = pnp_points(face_points, (self._face_2d, self._face_3d))
+        rot_vec = self.solve(face_3d, face_2d, img_w, img_h)
+        rmat, _ = cv2.Rodrigues(rot_vec, self._rmat)
+        angles = euler_angles(rmat)
+        return angles[0] * ANGLE_SCALE, -angles[1] * ANGLE_SCALE
+
+    def estimate_batch(self, points, img_w, img_h, cold=None):
+        """(pitch, yaw) arrays for a whole (F, len(INDICES), 3) array of gathered points,
+        one face per frame, e.g. an offline run. Each frame is warm-started from the
+        previous one, except where the (F,) bool mask cold is set (e.g. after frames
+        without a face). Rotation matrices come from cv2.Rodrigues, as in estimate(), so
+        the angles are bit-identical to a frame by frame run; they are computed at once."""
+        face_2d, face_3d = pnp_points(points)
+        rmats = np.empty((len(points), 3, 3))
+        for frame in range(len(points)):
+            if cold is not None and cold[frame]:
+                self.reset()
+            cv2.Rodrigues(self.solve(face_3d[frame], face_2d[frame], img_w, img_h), rmats[frame])
+        angles = euler_angles(rmats)
+        return angles[:, 0] * ANGLE_SCALE, -angles[:, 1] * ANGLE_SCALE
+
+
+def estimate_poses(estimators, points, img_w, img_h):
+    """(pitch, yaw) arrays for the faces of one frame, points (N_faces, len(INDICES), 3),
+    each face solved with its own (warm-started) estimator; rotation matrices and
+    angles are computed for all the faces at once."""
+    face_2d, face_3d = pnp_points(points)
+    rot_vecs = np.empty((len(points), 3))
+    for face, estimator in enumerate(estimators):
+        rot_vecs[face] = estimator.solve(face_3d[face], face_2d[face], img_w, img_h).ravel()
+    angles = euler_angles(rodrigues(rot_vecs))
+    return angles[:, 0] * ANGLE_SCALE, -angles[:, 1] * ANGLE_SCALE
@@ -0,0 +1,120 @@
+#**************************************************************************************
+#
+#   Driver Monitoring Systems using AI
+#
+#   File: dm_roi.py
+#
+#   Face ROI tracking: FaceMesh runs on a downscaled crop around the face found in the
+#   previous frame, and the landmarks are mapped back to full-frame coordinates.
+#
+#**************************************************************************************
+
+import time
+
+import cv2
+import numpy as np
+
+from dm_landmarks import X, Y, Z, detect_landmarks
+
+ROI_PADDING = 0.25  # Box margin on each side, as a fraction of the face size
+ROI_SIZE = 256      # [px] longer side of the crop given to FaceMesh
+ROI_MIN_SIZE = 128
+ROI_MAX_SIZE = 512
+ROI_STEP = 0.85     # Resolution change factor when adapting to the latency budget
+ROI_RESCAN_INTERVAL = 15 # Frames between two full-frame inferences while faces may be missing
+
+
+class FaceROI:
+    """Wraps a FaceMesh: crops each frame to a padded box around the landmarks of the
+    previous frame, downscales the crop to `size` (longer side) and runs FaceMesh on it.
+    When no face is found in the crop (or there is no previous face) the full frame is
+    used instead, for the same frame. With max_faces > 1 (occupants), the full frame is
+    also used every rescan_interval frames while fewer faces are tracked, so someone
+    appearing outside the box of the others is found.
+
+    With a latency_budget [s], the crop resolution is lowered when inference is slower
+    than the budget and raised again (up to max_size) when there is room.
+
+    landmarks(image) returns (N_faces, 478, 3) normalized to the full frame, so the
+    EAR, gaze and pose math downstream is unchanged."""
+
+    def __init__(self, face_mesh, padding=ROI_PADDING, size=ROI_SIZE, min_size=ROI_MIN_SIZE,
+                 max_size=ROI_MAX_SIZE, latency_budget=None, max_faces=1, rescan_interval=ROI_RESCAN_INTERVAL):
+        self.face_mesh = face_mesh
+        self.padding = padding
+        self.size = size
+        self.min_size = min_size
+        self.max_size = max_size
+        self.latency_budget = latency_budget
+        self.max_faces = max_faces
+        self.rescan_interval = rescan_interval
+        self.box = None       # (x0, y0, x1, y1) [px] from the previous frame
+        self.crops = 0        # frames processed on the crop
+        self.full_frames = 0  # frames processed on the full frame (no face yet, lost, or rescan)
+        self._since_full = 0  # crops since the last full frame
+        self._faces = 0       # faces found in the previous frame
+
+    def landmarks(self, image, timestamp=None, out=None):
+        img_h, img_w = image.shape[:2]
+        start = time.perf_counter()
+
+        landmarks = None
+        if self.box is not None and not self._rescan():
+            landmarks = self._crop_landmarks(image, img_w, img_h, timestamp, out)
+            self.crops += 1
+            self._since_full += 1
+        if landmarks is None or not len(landmarks):
+            # Face lost (or never found), or looking for the missing occupants: full frame
+            landmarks = detect_landmarks(self.face_mesh, image, timestamp, out)
+            self.full_frames += 1
+            self._since_full = 0
+
+        self.box = self._face_box(landmarks, img_w, img_h)
+        self._faces = len(landmarks)
+        if self.latency_budget is not None:
+            self._adapt(time.perf_counter() - start)
+        return landmarks
+
+    def _rescan(self):
+        return self._faces < self.max_faces and self._since_full + 1 >= self.rescan_interval
+
+    def _crop_landmarks(self, image, img_w, img_h, timestamp, out):
+        x0, y0, x1, y1 = self.box
+        crop = image[y0:y1, x0:x1]
+        crop_h, crop_w = crop.shape[:2]
+
+        scale = self.size / max(crop_w, crop_h)
+        if scale < 1:
+            crop = cv2.resize(crop, (max(1, round(crop_w * scale)), max(1, round(crop_h * scale))),
+                              interpolation=cv2.INTER_AREA)
+        else:
+            crop = np.ascontiguousarray(crop)
+
+        landmarks = detect_landmarks(self.face_mesh, crop, timestamp, out)
+        if len(landmarks):
+            # Normalized crop coordinates -> normalized full-frame coordinates
+            # (z has the same scale as x, so it follows the width ratio)
+            landmarks[..., X] = (x0 + landmarks[..., X] * crop_w) / img_w
+            landmarks[..., Y] = (y0 + landmarks[..., Y] * crop_h) / img_h
+            landmarks[..., Z] *= crop_w / img_w
+        return landmarks
+
+    def _face_box(self, landmarks, img_w, img_h):
+        """Padded square box [px] around all the faces, clipped to the frame, or None."""
+        if not len(landmarks):
+            return None
+        xs = landmarks[..., X] * img_w
+        ys = landmarks[..., Y] * img_h
+        cx, cy = (xs.min() + xs.max()) / 2, (ys.min() + ys.max()) / 2
+        half = max(xs.max() - xs.min(), ys.max() - ys.min()) * (0.5 + self.padding)
+        x0, y0 = max(0, int(cx - half)), max(0, int(cy - half))
+        x1, y1 = min(img_w, int(cx + half) + 1), min(img_h, int(cy + half) + 1)
+        if x1 - x0 < 2 or y1 - y0 < 2:
+            return None
+        return x0, y0, x1, y1
+
+    def _adapt(self, elapsed):
+        if elapsed > self.latency_budget:
+            self.size = max(self.min_size, int(self.size * ROI_STEP))
+        elif elapsed < 0.7 * self.latency_budget:
+            self.size = min(self.max_size, int(self.size / ROI_STEP) + 1)
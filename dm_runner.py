@@ -0,0 +1,227 @@
+#**************************************************************************************
+#
+#   Driver Monitoring Systems using AI
+#
+#   File: dm_runner.py
+#
+#   Multi-camera / multi-cabin runner: one worker process per video source, each with
+#   its own FaceMesh and detection state, reporting events and stats to one aggregator.
+#
+#   Usage: python dm_runner.py 0 cabin1.mp4 cabin2.mp4 ...
+#
+#**************************************************************************************
+
+import argparse
+import multiprocessing as mproc
+import queue
+import time
+
+from dm_detector import DriverMonitor, create_face_mesh
+from dm_events import AlertTracker, EventPublisher, console, sink_from_spec
+from dm_roi import FaceROI
+from dm_window import DROWSINESS_MODES, MIN_EAR
+from dm_pipeline import Pipeline, BLOCK, DROP_OLDEST, OVERFLOW_POLICIES, open_capture, video_timebase
+
+STATS_INTERVAL = 1.0 # [s] between two stats reports of a stream
+
+
+def is_live(source):
+    """Capture devices and network streams can't wait for us, files can."""
+    source = str(source)
+    return source.isdigit() or "://" in source
+
+
+def _stats(pipeline, frames, faces, started, window_frames, window_start, now, latency):
+    return {
+        "frames": frames,
+        "faces": faces,
+        "fps": window_frames / (now - window_start) if now > window_start else 0.0,
+        "avg_fps": frames / (now - started) if now > started else 0.0,
+        "latency": latency,
+        # Back-pressure: frames lost to a full queue, time spent waiting on one, and queue depth
+        "dropped": pipeline.captured.dropped + pipeline.processed.dropped,
+        "blocked_time": pipeline.captured.blocked_time + pipeline.processed.blocked_time,
+        "queued": len(pipeline.captured) + len(pipeline.processed),
+    }
+
+
+def stream_worker(stream_id, source, results, queue_size=2, overflow=None, stats_interval=STATS_INTERVAL,
+                  drowsiness_mode=MIN_EAR, roi=False):
+    """Process one source until it ends, posting ("event" | "stats" | "done", stream_id, dict)
+    messages on the results queue; events are the alert start/stop events of dm_events.
+
+    Files are timed by their container timestamps, as in dm_offline: the alerts of a
+    recording don't depend on how fast it is processed. FPS and latency stay wall clock."""
+    live = is_live(source)
+    if overflow is None:
+        overflow = DROP_OLDEST if live else BLOCK
+
+    face_mesh = create_face_mesh()
+    if roi:
+        face_mesh = FaceROI(face_mesh)
+    monitor = DriverMonitor(drowsiness_mode=drowsiness_mode)
+    cap = open_capture(source)
+    if not cap.isOpened():
+        results.put(("done", stream_id, {"error": f"cannot open source {source!r}"}))
+        return
+
+    pipeline = Pipeline(cap, face_mesh, monitor, queue_size=queue_size, overflow=overflow,
+                        timebase=None if live else video_timebase).start()
+    alerts = AlertTracker(stream_id)
+    frames = faces = window_frames = 0
+    latency = 0.0
+    started = window_start = time.monotonic()
+
+    try:
+        for frame in pipeline.frames():
+            now = time.monotonic()
+            frames += 1
+            window_frames += 1
+            latency = frame.age(now)
+            signals = frame.signals
+            if signals is not None:
+                faces += 1
+
+            # Alerts are reported on state changes only
+            for event in alerts.update(signals, frame.index, frame.timestamp):
+                results.put(("event", stream_id, event))
+
+            if now - window_start >= stats_interval:
+                results.put(("stats", stream_id,
+                             _stats(pipeline, frames, faces, started, window_frames, window_start, now, latency)))
+                window_frames = 0
+                window_start = now
+    finally:
+        pipeline.stop()
+        cap.release()
+    for event in alerts.close():
+        results.put(("event", stream_id, event))
+
+    now = time.monotonic()
+    results.put(("done", stream_id, _stats(pipeline, frames, faces, started, frames, started, now, latency)))
+
+
+class Aggregator:
+    """Collects the messages of all the streams: latest stats, final stats and events."""
+
+    def __init__(self, sources):
+        self.sources = dict(enumerate(sources))
+        self.stats = {}
+        self.events = []
+        self.done = {}
+
+    def handle(self, message):
+        kind, stream_id, payload = message
+        if kind == "event":
+            self.events.append((stream_id, payload))
+        elif kind == "stats":
+            self.stats[stream_id] = payload
+        elif kind == "done":
+            self.done[stream_id] = payload
+            if "error" not in payload:
+                self.stats[stream_id] = payload
+        return kind, stream_id, payload
+
+    def finished(self):
+        return len(self.done) == len(self.sources)
+
+    def summary(self):
+        lines = [f"{'stream':>6} {'fps':>7} {'avg fps':>7} {'latency':>9} {'dropped':>7} {'blocked':>8} {'queued':>6}  source"]
+        for stream_id, source in self.sources.items():
+            stats = self.stats.get(stream_id)
+            error = self.done.get(stream_id, {}).get("error")
+            if error:
+                lines.append(f"{stream_id:>6} {error}")
+            elif stats:
+                lines.append(f"{stream_id:>6} {stats['fps']:7.1f} {stats['avg_fps']:7.1f} "
+                             f"{stats['latency'] * 1000:7.0f}ms {stats['dropped']:7d} "
+                             f"{stats['blocked_time']:7.2f}s {stats['queued']:6d}  {source}")
+            else:
+                lines.append(f"{stream_id:>6} {'-':>7} {'-':>7} {'-':>9} {'-':>7} {'-':>8} {'-':>6}  {source}")
+        return "\n".join(lines)
+
+
+def run_streams(sources, queue_size=2, overflow=None, stats_interval=STATS_INTERVAL, on_message=None,
+                drowsiness_mode=MIN_EAR, roi=False):
+    """Run one worker process per source and aggregate their messages until all end."""
+    results = mproc.Queue()
+    aggregator = Aggregator(sources)
+    workers = {
+        stream_id: mproc.Process(target=stream_worker, name=f"stream-{stream_id}",
+                                 args=(stream_id, source, results, queue_size, overflow, stats_interval,
+                                       drowsiness_mode, roi))
+        for stream_id, source in aggregator.sources.items()
+    }
+    for worker in workers.values():
+        worker.start()
+
+    try:
+        while not aggregator.finished():
+            try:
+                message = aggregator.handle(results.get(timeout=stats_interval))
+            except queue.Empty:
+                # A worker that died without saying goodbye still has to be accounted for
+                for stream_id, worker in workers.items():
+                    if stream_id not in aggregator.done and not worker.is_alive():
+                        aggregator.handle(("done", stream_id, {"error": f"worker exited with code {worker.exitcode}"}))
+                continue
+            if on_message is not None:
+                on_message(aggregator, message)
+    finally:
+        for worker in workers.values():
+            worker.join(timeout=5)
+            if worker.is_alive():
+                worker.terminate()
+
+    return aggregator
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the driver monitor on several video sources")
+    parser.add_argument("sources", nargs="+", help="capture device indexes, video files or stream URLs")
+    parser.add_argument("--queue-size", type=int, default=2, help="frames buffered between two stages (default: 2)")
+    parser.add_argument("--overflow", choices=OVERFLOW_POLICIES, default=None,
+                        help="full queue policy (default: drop-oldest for live sources, block for files)")
+    parser.add_argument("--stats-interval", type=float, default=STATS_INTERVAL, help="seconds between stats reports")
+    parser.add_argument("--drowsiness-mode", choices=DROWSINESS_MODES, default=MIN_EAR,
+                        help="drowsiness rule (default: %(default)s)")
+    parser.add_argument("--roi", action="store_true", help="run FaceMesh on a crop around the previous face")
+    parser.add_argument("--events", nargs="+", default=None, metavar="SINK",
+                        help="publish alert and stats events to stdout, file:PATH and/or unix:PATH")
+    args = parser.parse_args()
+
+    out = console(args.events) # not stdout when the events are written there
+    publisher = None
+    if args.events:
+        publisher = EventPublisher([sink_from_spec(spec) for spec in args.events]).start()
+        for stream_id, source in enumerate(args.sources):
+            publisher.publish({"type": "stream", "state": "start", "stream": stream_id, "source": source,
+                               "time": time.time()})
+
+    def on_message(aggregator, message):
+        kind, stream_id, payload = message
+        if kind == "event":
+            print(f"[stream {stream_id}] {payload['alert']} {payload['state']} at frame {payload['frame']}", file=out)
+        elif kind == "stats" and stream_id == max(aggregator.stats):
+            print(aggregator.summary(), file=out)
+        if publisher is None:
+            return
+        if kind == "event":
+            publisher.publish(payload)
+        elif kind == "stats":
+            publisher.publish({"type": "stats", "stream": stream_id, "time": time.time(), "metrics": payload})
+        else:
+            publisher.publish({"type": "stream", "state": "stop", "stream": stream_id, "time": time.time(),
+                               "metrics": payload})
+
+    try:
+        aggregator = run_streams(args.sources, args.queue_size, args.overflow, args.stats_interval, on_message,
+                                 args.drowsiness_mode, args.roi)
+    finally:
+        if publisher is not None:
+            publisher.close()
+    print(aggregator.summary(), file=out)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,189 @@
+#**************************************************************************************
+#
+#   Driver Monitoring Systems using AI
+#
+#   File: dm_scheduler.py
+#
+#   Latency-aware frame skipping: FaceMesh runs on one frame out of k, and the
+#   landmarks of the frames in between are predicted with a constant-velocity model.
+#   Fast eye changes (blinks, closures) and large motion always force a real inference.
+#
+#**************************************************************************************
+
+import math
+import time
+
+import cv2
+import numpy as np
+
+from dm_landmarks import INDICES, EYE_BOX_SLOTS, EAR_SLOTS, PNP_SLOTS, IRIS_SLOTS, X, Y, detect_landmarks
+
+SKIP_K = 2                  # Inference on one frame out of k
+SKIP_MAX_K = 6
+MOTION_THRESHOLD = 6.0      # [px] predicted head/iris displacement forcing an inference
+EYE_CHANGE_THRESHOLD = 6.0  # mean abs gray level change of the eye patches forcing an inference
+EYE_SPEED_THRESHOLD = 0.5   # [1/s] |d EAR / dt| between the last two inferences forcing an inference
+EYE_PATCH_SIZE = (16, 8)    # [px] (w, h) eye thumbnails compared between frames
+TIME_SMOOTHING = 0.1        # EMA factor of the measured inference / prediction times
+
+# Landmarks (into the 478) watched by the motion check: PnP points and iris centers
+_MOTION_INDICES = INDICES[np.concatenate([PNP_SLOTS, IRIS_SLOTS])]
+_EYE_BOX_INDICES = INDICES[EYE_BOX_SLOTS] # (2, 4)
+_EAR_INDICES = INDICES[EAR_SLOTS]         # (2, 6)
+
+
+def _ear(landmarks, img_w, img_h):
+    """(N_faces,) mean EAR of the two eyes of each face, from normalized landmarks."""
+    p = landmarks[:, _EAR_INDICES, :2] * (img_w, img_h) # (N, 2, 6, 2)
+    vertical = np.abs(p[..., 1, Y] - p[..., 5, Y]) + np.abs(p[..., 2, Y] - p[..., 4, Y])
+    horizontal = 2 * np.abs(p[..., 0, X] - p[..., 3, X])
+    return np.mean(vertical / np.maximum(horizontal, 1e-6), axis=-1)
+
+
+def _eye_patches(image, landmarks, img_w, img_h):
+    """Small grayscale thumbnails of both eyes of every face, or None."""
+    patches = []
+    for face, eye in np.ndindex(len(landmarks), len(_EYE_BOX_INDICES)):
+        p = landmarks[face, _EYE_BOX_INDICES[eye], :2] * (img_w, img_h)
+        x0, y0 = p.min(axis=0)
+        x1, y1 = p.max(axis=0)
+        pad = (x1 - x0) * 0.25
+        x0, y0 = max(0, int(x0 - pad)), max(0, int(y0 - pad))
+        x1, y1 = min(img_w, int(x1 + pad) + 1), min(img_h, int(y1 + pad) + 1)
+        if x1 - x0 < 2 or y1 - y0 < 2:
+            return None
+        patch = cv2.resize(image[y0:y1, x0:x1], EYE_PATCH_SIZE, interpolation=cv2.INTER_AREA)
+        if patch.ndim == 3:
+            patch = patch.mean(axis=2)
+        patches.append(patch.astype(np.float32))
+    return patches
+
+
+class FrameScheduler:
+    """Wraps a FaceMesh (or FaceROI): real inference on one frame out of k, constant-
+    velocity prediction of all the landmarks on the others.
+
+    An inference is forced, whatever k, when: there is no face to predict from, the
+    eye patches changed since the last inference (EYE_CHANGE_THRESHOLD), the EAR was
+    changing fast at the last inferences (EYE_SPEED_THRESHOLD), or the predicted
+    motion of the PnP points / iris centers is large (MOTION_THRESHOLD). The eyes of
+    every face are checked, so the blinks and eye closures of all the occupants are
+    seen by the detector, not smoothed away.
+
+    With target_fps, k is recomputed after each frame from the measured inference
+    and prediction times to hold that frame rate."""
+
+    def __init__(self, face_mesh, k=SKIP_K, max_k=SKIP_MAX_K, target_fps=None,
+                 motion_threshold=MOTION_THRESHOLD, eye_change_threshold=EYE_CHANGE_THRESHOLD,
+                 eye_speed_threshold=EYE_SPEED_THRESHOLD):
+        self.face_mesh = face_mesh
+        self.k = k
+        self.max_k = max_k
+        self.target_fps = target_fps
+        self.motion_threshold = motion_threshold
+        self.eye_change_threshold = eye_change_threshold
+        self.eye_speed_threshold = eye_speed_threshold
+        self.inferences = 0
+        self.predictions = 0
+        self.predicted = False # the last landmarks were predicted
+        self._last = None      # landmarks of the last inference
+        self._velocity = None  # normalized units / s
+        self._t_last = None
+        self._ear_last = None
+        self._ear_speed = 0.0
+        self._patches = None
+        self._shape = None
+        self._since = 0        # frames predicted since the last inference
+        self._infer_time = None
+        self._predict_time = 0.0
+
+    def landmarks(self, image, timestamp=None, out=None):
+        if timestamp is None:
+            timestamp = time.monotonic()
+        start = time.perf_counter()
+
+        if self._must_infer(image, timestamp):
+            landmarks = detect_landmarks(self.face_mesh, image, timestamp, out)
+            self._track(image, landmarks, timestamp)
+            self._infer_time = self._smooth(self._infer_time, time.perf_counter() - start)
+            self.inferences += 1
+            self.predicted = False
+            self._since = 0
+        else:
+            landmarks = self._predict(timestamp, out)
+            self._predict_time = self._smooth(self._predict_time, time.perf_counter() - start)
+            self.predictions += 1
+            self.predicted = True
+            self._since += 1
+
+        if self.target_fps:
+            self._adapt()
+        return landmarks
+
+    def _predict(self, timestamp, out):
+        """Constant-velocity landmarks at timestamp, written into out when it has room."""
+        if out is None or len(out) < len(self._last):
+            return (self._last + self._velocity * (timestamp - self._t_last)).astype(np.float32)
+        landmarks = out[:len(self._last)]
+        np.multiply(self._velocity, timestamp - self._t_last, out=landmarks)
+        landmarks += self._last
+        return landmarks
+
+    def _must_infer(self, image, timestamp):
+        if self._last is None or not len(self._last) or image.shape != self._shape:
+            return True
+        if self._since + 1 >= self.k or self._ear_speed > self.eye_speed_threshold:
+            return True
+
+        img_h, img_w = image.shape[:2]
+        motion = self._velocity[:, _MOTION_INDICES, :2] * (timestamp - self._t_last) * (img_w, img_h)
+        if np.abs(motion).max() > self.motion_threshold:
+            return True
+
+        # Eyelids move before any landmark would: compare the eye regions themselves
+        patches = _eye_patches(image, self._last, img_w, img_h)
+        if patches is None or self._patches is None or len(patches) != len(self._patches):
+            return True
+        change = max(float(np.mean(np.abs(a - b))) for a, b in zip(patches, self._patches))
+        return change > self.eye_change_threshold
+
+    def _track(self, image, landmarks, timestamp):
+        img_h, img_w = image.shape[:2]
+        self._shape = image.shape
+        if not len(landmarks):
+            self._last = landmarks
+            self._velocity = None
+            self._ear_last = None
+            self._ear_speed = 0.0
+            self._patches = None
+            return
+
+        ear = _ear(landmarks, img_w, img_h)
+        if self._last is not None and self._last.shape == landmarks.shape and timestamp > self._t_last:
+            elapsed = timestamp - self._t_last
+            self._velocity = (landmarks - self._last) / elapsed
+            self._ear_speed = float(np.abs(ear - self._ear_last).max()) / elapsed
+        else:
+            self._velocity = np.zeros_like(landmarks)
+            self._ear_speed = 0.0
+        self._last = landmarks.copy()
+        self._t_last = timestamp
+        self._ear_last = ear
+        self._patches = _eye_patches(image, landmarks, img_w, img_h)
+
+    def _adapt(self):
+        """Smallest k with (inference + (k - 1) predictions) / k within the frame budget."""
+        if self._infer_time is None:
+            return
+        budget = 1 / self.target_fps
+        if self._infer_time <= budget:
+            self.k = 1
+        elif self._predict_time >= budget:
+            self.k = self.max_k
+        else:
+            k = math.ceil((self._infer_time - self._predict_time) / (budget - self._predict_time))
+            self.k = max(1, min(self.max_k, k))
+
+    @staticmethod
+    def _smooth(average, value):
+        return value if average is None else average + TIME_SMOOTHING * (value - average)
@@ -0,0 +1,248 @@
+#**************************************************************************************
+#
+#   Driver Monitoring Systems using AI
+#
+#   File: dm_sweep.py
+#
+#   Threshold sweep: evaluates the drowsiness and distraction rules for thousands of
+#   parameter combinations at once, as (params x frames) array operations, against
+#   labelled ground-truth intervals.
+#
+#   Usage: python dm_sweep.py signals.npz labels.csv --rule drowsiness \
+#              --open-val 0.26:0.36:0.02 --norm-ear-threshold 0.5:0.8:0.02 -o sweep.csv
+#   labels.csv: one "label,start,end" row per interval (label: drowsy | distracted, times in [s])
+#
+#**************************************************************************************
+
+import argparse
+import csv
+import itertools
+import multiprocessing as mproc
+import os
+
+import numpy as np
+
+from dm_detector import OPEN_VAL, CLOSED_VAL, X_THRESHOLD, Y_THRESHOLD, HEAD_POSE_LIMIT, BLINK_DETECTION_SECONDS
+from dm_offline import load_signals
+from dm_window import TEMPORAL_WINDOW_SECONDS, NORM_EAR_THRESHOLD, MAX_INTERVAL_RATIO
+
+DROWSINESS = "drowsiness"
+DISTRACTION = "distraction"
+
+## Swept parameters of each rule, with their defaults
+RULE_PARAMS = {
+    DROWSINESS: {
+        "open_val": OPEN_VAL,
+        "closed_val": CLOSED_VAL,
+        "norm_ear_threshold": NORM_EAR_THRESHOLD,
+        "window_seconds": TEMPORAL_WINDOW_SECONDS,
+        "max_interval_ratio": MAX_INTERVAL_RATIO,
+    },
+    DISTRACTION: {
+        "x_threshold": X_THRESHOLD,
+        "y_threshold": Y_THRESHOLD,
+        "head_pose_limit": HEAD_POSE_LIMIT,
+        "blink_detection_seconds": BLINK_DETECTION_SECONDS,
+    },
+}
+RULE_LABEL = {DROWSINESS: "drowsy", DISTRACTION: "distracted"}
+
+MAX_CHUNK_ELEMENTS = 2 ** 24 # params x frames evaluated per chunk, bounds the memory used
+
+
+def grid(rule, **values):
+    """Cartesian product of the given values; parameters left out keep their default.
+    Returns {name: (P,) array}."""
+    names = list(RULE_PARAMS[rule])
+    unknown = set(values) - set(names)
+    if unknown:
+        raise ValueError(f"unknown {rule} parameters: {sorted(unknown)}")
+    axes = [np.atleast_1d(np.asarray(values.get(name, RULE_PARAMS[rule][name]), dtype=np.float64))
+            for name in names]
+    mesh = np.meshgrid(*axes, indexing="ij")
+    return {name: axis.ravel() for name, axis in zip(names, mesh)}
+
+
+def frame_intervals(signals):
+    """Timestamps and frame intervals dt of the frames with a face, as the detector sees
+    them: dt is the interval to the immediately preceding frame, with or without a face
+    (the time of a gap without a face is not added to the next frame)."""
+    timestamps = np.asarray(signals["timestamp"], dtype=np.float64)
+    dt = np.diff(timestamps, prepend=timestamps[:1])
+    face = np.asarray(signals["face"], dtype=bool)
+    return face, timestamps[face], dt[face]
+
+
+def drowsiness_alerts(signals, params):
+    """(P, F) drowsy flags of the frames with a face, for P parameter combinations."""
+    face, _, dt = frame_intervals(signals)
+    min_ear = np.min(np.asarray(signals["ear"], dtype=np.float64)[face], axis=1)
+
+    # min normalized EAR < threshold  <=>  min EAR < closed + threshold * (open - closed)
+    ear_threshold = params["closed_val"] + params["norm_ear_threshold"] * (params["open_val"] - params["closed_val"])
+    closed_dt = np.where(min_ear[None, :] < ear_threshold[:, None], dt[None, :], 0.0)
+    closed_cum = np.zeros((len(ear_threshold), len(dt) + 1))
+    np.cumsum(closed_dt, axis=1, out=closed_cum[:, 1:])
+
+    # Window start of each frame: samples are evicted while the window is longer than
+    # its duration, before the frame is added (see SlidingWindows.push)
+    time_cum = np.concatenate([[0.0], np.cumsum(dt)])
+    frames = np.arange(len(dt))
+    drowsy = np.empty(closed_dt.shape, dtype=bool)
+    for seconds in np.unique(params["window_seconds"]):
+        rows = np.flatnonzero(params["window_seconds"] == seconds)
+        start = np.minimum(np.searchsorted(time_cum, time_cum[:-1] - seconds, side="left"), frames)
+        closed_time = closed_cum[rows][:, frames + 1] - closed_cum[rows][:, start]
+        drowsy[rows] = closed_time >= (params["max_interval_ratio"][rows] * seconds)[:, None]
+    return drowsy
+
+
+def distraction_alerts(signals, params):
+    """(P, F) distracted flags of the frames with a face, for P parameter combinations."""
+    face, _, dt = frame_intervals(signals)
+    gaze = np.abs(np.asarray(signals["gaze"], dtype=np.float64)[face]) # (F, eye, X/Y)
+    gaze_x = gaze[:, :, 0].max(axis=1)
+    gaze_y = gaze[:, :, 1].max(axis=1)
+    head = np.max(np.abs(np.stack([signals["roll"], signals["pitch"], signals["yaw"]], axis=1)
+                         .astype(np.float64)[face]), axis=1)
+
+    raw = ((gaze_x[None, :] > params["x_threshold"][:, None])
+           | (gaze_y[None, :] > params["y_threshold"][:, None])
+           | (head[None, :] > params["head_pose_limit"][:, None]))
+
+    # distracted_time grows by dt while distracted and is reset otherwise:
+    # time since the last non-distracted frame, from the cumulative distracted time
+    cum = np.cumsum(np.where(raw, dt[None, :], 0.0), axis=1)
+    base = np.maximum.accumulate(np.where(raw, 0.0, cum), axis=1)
+    return (cum - base) > params["blink_detection_seconds"][:, None]
+
+
+def score(alerts, timestamps, intervals, grace=1.0):
+    """Event-level scores of (P, F) alert flags against ground-truth (start, end) intervals.
+
+    recall:    fraction of intervals with an alert within [start, end + grace]
+    precision: fraction of alert onsets falling within an interval (same tolerance)
+    latency:   mean delay [s] from interval start to the first alert, over detected intervals"""
+    n_params = len(alerts)
+    onsets = alerts.copy()
+    onsets[:, 1:] &= ~alerts[:, :-1]
+    n_onsets = onsets.sum(axis=1)
+
+    in_any = np.zeros(len(timestamps), dtype=bool)
+    detected = np.zeros(n_params)
+    latency_sum = np.zeros(n_params)
+    for start, end in intervals:
+        mask = (timestamps >= start) & (timestamps <= end + grace)
+        in_any |= mask
+        window = alerts[:, mask]
+        if not window.shape[1]:
+            continue
+        hit = window.any(axis=1)
+        first = timestamps[mask][np.argmax(window, axis=1)]
+        detected += hit
+        latency_sum += np.where(hit, np.maximum(first - start, 0.0), 0.0)
+
+    true_onsets = onsets[:, in_any].sum(axis=1)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        precision = np.where(n_onsets > 0, true_onsets / n_onsets, 0.0)
+        recall = detected / len(intervals) if len(intervals) else np.zeros(n_params)
+        latency = np.where(detected > 0, latency_sum / detected, np.nan)
+        f1 = np.where(precision + recall > 0, 2 * precision * recall / (precision + recall), 0.0)
+    return {"precision": precision, "recall": recall, "f1": f1, "latency": latency, "alerts": n_onsets}
+
+
+def load_intervals(path):
+    """Ground truth from a CSV with label,start,end columns: {label: [(start, end), ...]}."""
+    intervals = {}
+    with open(path, newline="") as labels:
+        for row in csv.DictReader(labels):
+            intervals.setdefault(row["label"].strip(), []).append((float(row["start"]), float(row["end"])))
+    return intervals
+
+
+## Worker side of sweep(): signals are shared once per process, not per chunk
+_shared = {}
+
+
+def _init_worker(signals, rule, intervals, grace):
+    _shared.update(signals=signals, rule=rule, intervals=intervals, grace=grace)
+
+
+def _evaluate(params):
+    signals = _shared["signals"]
+    alerts = (drowsiness_alerts if _shared["rule"] == DROWSINESS else distraction_alerts)(signals, params)
+    _, timestamps, _ = frame_intervals(signals)
+    return score(alerts, timestamps, _shared["intervals"], _shared["grace"])
+
+
+def sweep(signals, intervals, rule, params, grace=1.0, processes=None, chunk=None):
+    """Evaluate every parameter combination of params (from grid()) on the signals of
+    dm_offline, against the (start, end) ground-truth intervals of the rule.
+    Combinations are split into chunks evaluated in parallel on `processes` cores.
+    Returns params plus the score() columns, all (P,) arrays."""
+    n_params = len(next(iter(params.values())))
+    n_frames = max(int(np.count_nonzero(signals["face"])), 1)
+    if chunk is None:
+        chunk = max(1, MAX_CHUNK_ELEMENTS // n_frames)
+    chunks = [{name: values[i:i + chunk] for name, values in params.items()} for i in range(0, n_params, chunk)]
+
+    if processes is None:
+        processes = min(os.cpu_count() or 1, len(chunks))
+    if processes > 1:
+        with mproc.Pool(processes, _init_worker, (signals, rule, intervals, grace)) as pool:
+            scores = pool.map(_evaluate, chunks)
+    else:
+        _init_worker(signals, rule, intervals, grace)
+        scores = [_evaluate(part) for part in chunks]
+
+    results = dict(params)
+    for name in scores[0]:
+        results[name] = np.concatenate([part[name] for part in scores])
+    return results
+
+
+def parse_values(text):
+    """"a:b:step" range (b included) or "a,b,c" list."""
+    if ":" in text:
+        start, stop, step = (float(v) for v in text.split(":"))
+        return np.arange(start, stop + step / 2, step)
+    return np.array([float(v) for v in text.split(",")])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Sweep the detection thresholds against labelled intervals")
+    parser.add_argument("signals", help="per-frame signals from dm_offline.py (.npz)")
+    parser.add_argument("labels", help="ground truth CSV with label,start,end columns")
+    parser.add_argument("--rule", choices=tuple(RULE_PARAMS), default=DROWSINESS)
+    for name, default in itertools.chain(*(rule.items() for rule in RULE_PARAMS.values())):
+        parser.add_argument("--" + name.replace("_", "-"), type=parse_values, default=None,
+                            help=f"values to sweep, a:b:step or a,b,c (default: {default})")
+    parser.add_argument("--grace", type=float, default=1.0, help="[s] an alert may come this late after an interval")
+    parser.add_argument("--processes", type=int, default=None, help="worker processes (default: all cores)")
+    parser.add_argument("--top", type=int, default=10, help="combinations printed, best F1 (then latency) first")
+    parser.add_argument("-o", "--output", default=None, help="CSV with every combination")
+    args = parser.parse_args()
+
+    values = {name: getattr(args, name) for name in RULE_PARAMS[args.rule] if getattr(args, name) is not None}
+    params = grid(args.rule, **values)
+    intervals = load_intervals(args.labels).get(RULE_LABEL[args.rule], [])
+    results = sweep(load_signals(args.signals), intervals, args.rule, params, args.grace, args.processes)
+
+    columns = list(results)
+    # Best F1 first, then lowest latency
+    order = np.lexsort((np.nan_to_num(results["latency"], nan=np.inf), -results["f1"]))
+    if args.output:
+        with open(args.output, "w", newline="") as out:
+            writer = csv.writer(out)
+            writer.writerow(columns)
+            for i in order:
+                writer.writerow([results[name][i] for name in columns])
+
+    print(f"{len(order)} combinations, {len(intervals)} '{RULE_LABEL[args.rule]}' intervals")
+    print(" ".join(f"{name:>12.12}" for name in columns))
+    for i in order[:args.top]:
+        print(" ".join(f"{results[name][i]:12.4g}" for name in columns))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,156 @@
+#**************************************************************************************
+#
+#   Driver Monitoring Systems using AI
+#
+#   File: dm_window.py
+#
+#   Sliding time windows over the per-frame eye state, with running totals updated
+#   in O(1) per frame, and the drowsiness rules built on them (min EAR / PERCLOS).
+#
+#**************************************************************************************
+
+import math
+
+from array import array
+
+# Drowsiness modes
+MIN_EAR = "min-ear"         # min normalized EAR below NORM_EAR_THRESHOLD for 80% of the window
+PERCLOS_P70 = "perclos-p70" # fraction of time with the eyes at least 70% closed
+PERCLOS_P80 = "perclos-p80" # fraction of time with the eyes at least 80% closed
+DROWSINESS_MODES = (MIN_EAR, PERCLOS_P70, PERCLOS_P80)
+
+TEMPORAL_WINDOW_SECONDS = 10
+NORM_EAR_THRESHOLD = 0.68
+MAX_INTERVAL_RATIO = 0.8 # MIN_EAR: closed time needed, as a fraction of the window
+PERCLOS_CLOSURE = {PERCLOS_P70: 0.7, PERCLOS_P80: 0.8}
+PERCLOS_THRESHOLD = 0.15 # PERCLOS above which the driver is drowsy
+
+RESYNC_PUSHES = 4096 # Running sums are recomputed exactly this often, to cancel float drift
+RING_CAPACITY = 1024 # Initial samples held by SlidingWindows (10 s at up to ~100 fps)
+
+
+class SlidingWindows:
+    """Several time windows over one shared stream of (dt, closed) samples.
+
+    Each window keeps its own start index and running totals (time, closed time,
+    frame counts), so a push costs O(1) per window whatever its length. As in the
+    original deque code, samples are evicted while the window is longer than its
+    duration *before* the new sample is added.
+
+    Samples live in a preallocated ring of raw doubles/bytes, grown (doubled) only
+    while the windows are filling up: once they have, a push allocates nothing."""
+
+    def __init__(self, seconds=(TEMPORAL_WINDOW_SECONDS,), capacity=RING_CAPACITY):
+        self.seconds = tuple(seconds)
+        n = len(self.seconds)
+        self.total = [0.0] * n       # [s] covered by each window
+        self.closed_time = [0.0] * n # [s] with the eyes closed
+        self.count = [0] * n         # frames in each window
+        self.closed_count = [0] * n  # frames with the eyes closed
+        self.full = [False] * n      # the window has covered its whole duration at least once
+        self._dt = array("d", bytes(8 * capacity))
+        self._closed = bytearray(capacity)
+        self._capacity = capacity
+        self._next = 0               # sample number of the next push
+        self._head = [0] * n         # sample number of the oldest sample of each window
+        self._pushes = 0
+
+    def push(self, dt, closed):
+        dt_ring = self._dt
+        closed_ring = self._closed
+        capacity = self._capacity
+        for w, seconds in enumerate(self.seconds):
+            while self.total[w] > seconds:
+                i = self._head[w] % capacity
+                self.total[w] -= dt_ring[i]
+                self.count[w] -= 1
+                if closed_ring[i]:
+                    self.closed_time[w] -= dt_ring[i]
+                    self.closed_count[w] -= 1
+                self._head[w] += 1
+
+            self.total[w] += dt
+            self.count[w] += 1
+            if closed:
+                self.closed_time[w] += dt
+                self.closed_count[w] += 1
+            if self.total[w] >= seconds:
+                self.full[w] = True
+
+        if self._next - min(self._head) >= capacity:
+            self._grow()
+            dt_ring, closed_ring, capacity = self._dt, self._closed, self._capacity
+        i = self._next % capacity
+        dt_ring[i] = dt
+        closed_ring[i] = 1 if closed else 0
+        self._next += 1
+
+        self._pushes += 1
+        if self._pushes % RESYNC_PUSHES == 0:
+            self._resync()
+
+    def _samples(self, start):
+        """Indexes into the ring of the samples from sample number start on."""
+        return (n % self._capacity for n in range(start, self._next))
+
+    def _grow(self):
+        capacity = self._capacity * 2
+        dt_ring = array("d", bytes(8 * capacity))
+        closed_ring = bytearray(capacity)
+        for n in range(min(self._head), self._next):
+            dt_ring[n % capacity] = self._dt[n % self._capacity]
+            closed_ring[n % capacity] = self._closed[n % self._capacity]
+        self._dt, self._closed, self._capacity = dt_ring, closed_ring, capacity
+
+    def _resync(self):
+        for w in range(len(self.seconds)):
+            samples = list(self._samples(self._head[w]))
+            self.total[w] = math.fsum(self._dt[i] for i in samples)
+            self.closed_time[w] = math.fsum(self._dt[i] for i in samples if self._closed[i])
+
+    def perclos(self, w=0):
+        """Fraction of the time of window w spent with the eyes closed."""
+        return self.closed_time[w] / self.total[w] if self.total[w] > 0 else 0.0
+
+    def reset(self):
+        self.__init__(self.seconds)
+
+
+class DrowsinessDetector:
+    """Windowed drowsiness rule, selectable between:
+    - MIN_EAR: the min normalized EAR of the two eyes is below NORM_EAR_THRESHOLD for
+      at least MAX_INTERVAL_RATIO of the window (the original rule);
+    - PERCLOS_P70 / PERCLOS_P80: the mean eye opening is at most 30% / 20% for more
+      than PERCLOS_THRESHOLD of the window, once the window has been filled.
+    The first window is the one the alert is computed on; the others are tracked
+    alongside (e.g. 10 s and 60 s) and can be read through self.windows."""
+
+    def __init__(self, mode=MIN_EAR, windows=(TEMPORAL_WINDOW_SECONDS,),
+                 norm_ear_threshold=NORM_EAR_THRESHOLD, perclos_threshold=PERCLOS_THRESHOLD):
+        if mode not in DROWSINESS_MODES:
+            raise ValueError(f"unknown drowsiness mode: {mode}")
+        self.mode = mode
+        self.windows = SlidingWindows(windows)
+        self.norm_ear_threshold = norm_ear_threshold
+        self.perclos_threshold = perclos_threshold
+
+    def is_closed(self, left_open, right_open):
+        if self.mode == MIN_EAR:
+            return min(left_open, right_open) < self.norm_ear_threshold
+        return (left_open + right_open) / 2 <= 1 - PERCLOS_CLOSURE[self.mode]
+
+    def update(self, left_open, right_open, dt):
+        """Push one frame; returns (closed_time, perclos, drowsy) for the first window."""
+        windows = self.windows
+        windows.push(dt, self.is_closed(left_open, right_open))
+
+        closed_time = windows.closed_time[0]
+        perclos = windows.perclos(0)
+        if self.mode == MIN_EAR:
+            drowsy = closed_time >= MAX_INTERVAL_RATIO * windows.seconds[0]
+        else:
+            drowsy = windows.full[0] and perclos > self.perclos_threshold
+        return closed_time, perclos, drowsy
+
+    def reset(self):
+        self.windows.reset()